@@ -0,0 +1,227 @@
+import re
+import json
+import time
+import zlib
+import threading
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from synth import gmail_raw_record, message_id
+
+EMBED_DIM = 768
+
+class _Request:
+    """Mimics the googleapiclient request object: work happens on execute()."""
+
+    def __init__(self, fn, latency):
+        self._fn = fn
+        self._latency = latency
+
+    def execute(self):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._fn()
+
+class _Messages:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, q=None, pageToken=None):
+        def run():
+            start = int(pageToken or 0)
+            end = min(start + self._service.page_size, self._service.count)
+            result = {"messages": [{"id": message_id(i), "threadId": message_id(i)} for i in range(start, end)]}
+            if end < self._service.count:
+                result["nextPageToken"] = str(end)
+            return result
+        return _Request(run, self._service.latency)
+
+    def get(self, userId, id, format=None):
+        def run():
+            index = int(id[len("syn"):], 16)
+            return gmail_raw_record(index, self._service.seed)
+        return _Request(run, self._service.latency)
+
+class _Users:
+    def __init__(self, service):
+        self._messages = _Messages(service)
+
+    def messages(self):
+        return self._messages
+
+class FakeGmailService:
+    """
+    Stand-in for the object returned by `ingest.authenticate_gmail()`.
+    Messages are regenerated on demand from the synthetic mailbox, so even
+    the 1M scale does not need to be held in memory.
+    """
+
+    def __init__(self, count, seed=0, latency_ms=0, page_size=500):
+        self.count = count
+        self.seed = seed
+        self.latency = latency_ms / 1000.0
+        self.page_size = page_size
+        self._users = _Users(self)
+
+    def users(self):
+        return self._users
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_AMOUNT_RE = re.compile(r"Total:\s*([0-9]+(?:\.[0-9]+)?)\s*([A-Z]{3})")
+_MERCHANT_RE = re.compile(r"purchase from ([^.\n]+)\.")
+_CATEGORY_RE = re.compile(r"Category:\s*(\w+)")
+_DATE_RE = re.compile(r"Date:\s*(\d{4}-\d{2}-\d{2})")
+
+class _FakeModel:
+    """Deterministic, cheap replacements for the embedding and chat models."""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._token_vectors = {}
+        self._lock = threading.Lock()
+
+    def _token_vector(self, token):
+        vec = self._token_vectors.get(token)
+        if vec is None:
+            rng = np.random.default_rng((self.seed, zlib.crc32(token.encode())))
+            vec = rng.standard_normal(EMBED_DIM).astype(np.float32)
+            with self._lock:
+                self._token_vectors[token] = vec
+        return vec
+
+    def embed(self, text):
+        # Hashed bag-of-words: texts sharing vocabulary get nearby vectors,
+        # which keeps similarity search results meaningful.
+        tokens = _TOKEN_RE.findall(text.lower())
+        vec = np.zeros(EMBED_DIM, dtype=np.float32)
+        for token in tokens:
+            vec += self._token_vector(token)
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+        return vec.tolist()
+
+    def chat(self, messages):
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = next((m["content"] for m in messages if m["role"] == "user"), "")
+
+        if "SQL query parameter extractor" in system:
+            today = datetime.date.today()
+            return {
+                "metric": "sum",
+                "start_date": (today - datetime.timedelta(days=30)).isoformat(),
+                "end_date": today.isoformat(),
+            }
+
+        amount = _AMOUNT_RE.search(user)
+        if not amount:
+            return {}
+        merchant = _MERCHANT_RE.search(user)
+        category = _CATEGORY_RE.search(user)
+        date = _DATE_RE.search(user)
+        return {
+            "merchant": merchant.group(1) if merchant else "Unknown",
+            "amount": float(amount.group(1)),
+            "currency": amount.group(2),
+            "date": date.group(1) if date else None,
+            "category": category.group(1) if category else "Other",
+        }
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        start = time.perf_counter_ns()
+        if server.latency:
+            time.sleep(server.latency)
+
+        if self.path == "/api/embeddings":
+            payload = {"embedding": server.model.embed(request.get("prompt", ""))}
+        elif self.path == "/api/embed":
+            inputs = request.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            payload = {
+                "model": request.get("model"),
+                "embeddings": [server.model.embed(text) for text in inputs],
+                "prompt_eval_count": sum(len(text.split()) for text in inputs),
+            }
+        elif self.path == "/api/chat":
+            messages = request.get("messages", [])
+            content = json.dumps(server.model.chat(messages))
+            payload = {
+                "model": request.get("model"),
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": sum(len(m.get("content", "").split()) for m in messages),
+                "eval_count": len(content.split()),
+            }
+        else:
+            self._send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+            return
+
+        with server.stats_lock:
+            server.requests[self.path] = server.requests.get(self.path, 0) + 1
+        payload.setdefault("total_duration", time.perf_counter_ns() - start)
+        self._send_json(payload)
+
+class FakeOllamaServer:
+    """
+    Minimal HTTP server speaking the subset of the Ollama API mailtx uses
+    (/api/embeddings, /api/embed, /api/chat), with configurable latency.
+
+    Point the `ollama` client at it by setting OLLAMA_HOST to `self.host`
+    before `ollama` is first imported.
+    """
+
+    def __init__(self, latency_ms=0, seed=0, port=0):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), _OllamaHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.latency = latency_ms / 1000.0
+        self._httpd.model = _FakeModel(seed)
+        self._httpd.requests = {}
+        self._httpd.stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def host(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return dict(self._httpd.requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
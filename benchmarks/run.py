@@ -0,0 +1,310 @@
+"""
+Per-stage throughput benchmarks for the mailtx pipeline.
+
+Every run happens in a scratch directory against a seeded synthetic mailbox,
+a fake Gmail service and a fake Ollama server, so results only depend on the
+code under test and are comparable across commits:
+
+    uv run benchmarks/run.py --scale 1k --output bench.json
+    uv run benchmarks/run.py --scale 1k --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import datetime
+import contextlib
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synth
+from fakes import FakeGmailService, FakeOllamaServer
+
+# Pipeline order. A selected stage runs its prerequisites untimed first.
+STAGES = ["import_mbox", "ingest", "parse", "embed", "ledger", "find_similar", "search", "execute_query", "report"]
+# Alternative ways to load mail; only run when asked for.
+OPTIONAL_STAGES = {"import_mbox", "ingest"}
+DEFAULT_STAGES = [s for s in STAGES if s != "import_mbox"]
+
+SIMILAR_QUERIES = [
+    "uber ride receipt",
+    "amazon order total",
+    "netflix subscription payment",
+    "coffee at starbucks",
+    "electricity bill",
+    "weekly developer newsletter",
+    "garden club community event",
+    "airbnb booking charged",
+]
+
+def _query_params():
+    start = synth.ANCHOR_DATE.date() - datetime.timedelta(days=synth.SPAN_DAYS)
+    params = []
+    for merchant, _, _ in synth.MERCHANTS:
+        params.append({"metric": "sum", "merchant": merchant})
+        params.append({"metric": "list", "merchant": merchant,
+                       "start_date": start.isoformat(),
+                       "end_date": (start + datetime.timedelta(days=90)).isoformat()})
+    for month in range(1, 13):
+        first = datetime.date(2024, month, 1)
+        last = (first + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        params.append({"metric": "sum", "start_date": first.isoformat(), "end_date": last.isoformat()})
+    return params
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+def _count(table):
+    from mailtx import shards
+    counts = shards.fan_out(lambda c: c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], shards.databases())
+    return sum(counts)
+
+def _db_bytes():
+    from mailtx import db, shards
+    paths = {db.DB_PATH} | {path for path, _ in shards.databases()}
+    return sum(os.path.getsize(path) for path in paths)
+
+class Bench:
+    def __init__(self, args, count):
+        self.args = args
+        self.count = count
+        self.raw_dir = args.mailbox_dir or os.path.join(os.getcwd(), "data", "raw")
+
+    def import_mbox(self):
+        from mailtx import importer
+        mbox_path = os.path.join(os.getcwd(), "mailbox.mbox")
+        synth.write_mbox(mbox_path, self.count, self.args.seed)
+        start = time.perf_counter()
+        importer.import_path(mbox_path, fmt="mbox")
+        return {"items": _count("emails"), "seconds": time.perf_counter() - start,
+                "mb_per_sec": os.path.getsize(mbox_path) / 1e6 / (time.perf_counter() - start)}
+
+    def ingest(self):
+        from mailtx import ingest
+        service = FakeGmailService(self.count, seed=self.args.seed, latency_ms=self.args.gmail_latency_ms)
+        ingest.authenticate_gmail = lambda: service
+        ingest.download_recent_emails(days=synth.SPAN_DAYS)
+        return {"items": self.count}
+
+    def parse(self):
+        from mailtx import parser
+        if not os.path.exists(self.raw_dir):
+            synth.write_raw_files(self.raw_dir, self.count, self.args.seed)
+        start = time.perf_counter()
+        parser.process_raw_files(self.raw_dir)
+        return {"items": _count("emails"), "seconds": time.perf_counter() - start}
+
+    def embed(self):
+        from mailtx import embed
+        embed.set_precision(self.args.precision)
+        embed.generate_embeddings()
+        return {"items": _count("embeddings")}
+
+    def ledger(self):
+        from mailtx import ledger
+        ledger.build_ledger()
+        return {"items": _count("emails"), "tx": _count("tx")}
+
+    def find_similar(self):
+        from mailtx import embed, vectors
+        latencies = []
+        for i in range(self.args.queries):
+            start = time.perf_counter()
+            embed.find_similar(SIMILAR_QUERIES[i % len(SIMILAR_QUERIES)], top_k=10)
+            latencies.append(time.perf_counter() - start)
+        result = self._latency_result(latencies)
+        result["index_bytes"] = sum(vectors.index_nbytes(index) for _, index in embed._index_cache.values())
+        return result
+
+    def search(self):
+        from mailtx import search
+        latencies = []
+        for i in range(self.args.queries):
+            start = time.perf_counter()
+            search.search(SIMILAR_QUERIES[i % len(SIMILAR_QUERIES)], top_k=10)
+            latencies.append(time.perf_counter() - start)
+        return self._latency_result(latencies)
+
+    def execute_query(self):
+        from mailtx import query_engine
+        params = _query_params()
+        latencies = []
+        for i in range(self.args.queries):
+            start = time.perf_counter()
+            query_engine.execute_query(params[i % len(params)])
+            latencies.append(time.perf_counter() - start)
+        return self._latency_result(latencies)
+
+    def report(self):
+        from mailtx import report
+        latencies = []
+        for i in range(self.args.queries):
+            start = time.perf_counter()
+            report.generate_report()
+            latencies.append(time.perf_counter() - start)
+        return self._latency_result(latencies)
+
+    def _latency_result(self, latencies):
+        return {
+            "items": len(latencies),
+            "seconds": sum(latencies),
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+        }
+
+def run_stages(args, count, selected):
+    bench = Bench(args, count)
+    last = max(STAGES.index(s) for s in selected)
+    results = {}
+
+    for stage in STAGES[:last + 1]:
+        if stage in OPTIONAL_STAGES and stage not in selected:
+            # The parse stage generates the mailbox on disk directly.
+            continue
+        if stage == "parse" and "import_mbox" in selected and stage not in selected:
+            # import_mbox already loaded the mailbox; later stages use that one
+            continue
+        quiet = open(os.devnull, "w") if not args.verbose else None
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            result = getattr(bench, stage)()
+        elapsed = time.perf_counter() - start
+        if quiet:
+            quiet.close()
+
+        if stage not in selected:
+            continue
+        result.setdefault("seconds", elapsed)
+        result["items_per_sec"] = result["items"] / result["seconds"] if result["seconds"] else None
+        results[stage] = result
+        print(f"{stage:>14}: {result['items']:>9} items in {result['seconds']:.3f}s", file=sys.stderr)
+
+    return results
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline.get('commit') or baseline_path}", file=sys.stderr)
+    for stage, result in current["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old or not old.get("items_per_sec") or not result.get("items_per_sec"):
+            print(f"{stage:>14}: no baseline", file=sys.stderr)
+            continue
+        change = (result["items_per_sec"] / old["items_per_sec"] - 1) * 100
+        print(f"{stage:>14}: {old['items_per_sec']:.1f} -> {result['items_per_sec']:.1f} items/s ({change:+.1f}%)",
+              file=sys.stderr)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark mailtx pipeline stages")
+    arg_parser.add_argument("--scale", default="1k", help="1k, 100k, 1m or a message count (default: 1k)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Synthetic mailbox seed (default: 0)")
+    arg_parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                            help=f"Comma-separated subset of: {', '.join(STAGES)}")
+    arg_parser.add_argument("--queries", type=int, default=50, help="Queries per search/query stage (default: 50)")
+    arg_parser.add_argument("--ollama-latency-ms", type=float, default=0, help="Added latency per Ollama request")
+    arg_parser.add_argument("--gmail-latency-ms", type=float, default=0, help="Added latency per Gmail API call")
+    arg_parser.add_argument("--precision", default="float32", choices=["float32", "float16", "int8"],
+                            help="Vector storage precision for the embed stage (default: float32)")
+    arg_parser.add_argument("--body-codec", default="none", choices=["none", "zlib", "zstd"],
+                            help="Store email bodies with this codec (default: none)")
+    arg_parser.add_argument("--shard-by", default="none", choices=["none", "year", "quarter"],
+                            help="Database layout: one file, or one shard per year or quarter (default: none)")
+    arg_parser.add_argument("--mailbox-dir", help="Re-use (or create) a generated mailbox at this path")
+    arg_parser.add_argument("--workdir", help="Run in this directory instead of a temporary one")
+    arg_parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    arg_parser.add_argument("--compare", help="Print throughput change against a previous results file")
+    arg_parser.add_argument("--verbose", action="store_true", help="Show pipeline output")
+    args = arg_parser.parse_args()
+
+    selected = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in selected if s not in STAGES]
+    if unknown:
+        arg_parser.error(f"unknown stages: {', '.join(unknown)}")
+    if args.mailbox_dir:
+        args.mailbox_dir = os.path.abspath(args.mailbox_dir)
+    count = synth.parse_scale(args.scale)
+
+    server = FakeOllamaServer(latency_ms=args.ollama_latency_ms, seed=args.seed).start()
+    # The ollama client reads OLLAMA_HOST when the module is first imported.
+    os.environ["OLLAMA_HOST"] = server.host
+
+    original_cwd = os.getcwd()
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="mailtx-bench-"))
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+        try:
+            from mailtx import db
+            with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+                db.init_db()
+                conn = db.get_db_connection()
+                db.set_setting(conn, 'body_codec', args.body_codec)
+                conn.commit()
+                conn.close()
+                from mailtx import shards
+                shards.set_layout(args.shard_by, vacuum=False)
+            stages = run_stages(args, count, selected)
+            from mailtx import metrics
+            stage_metrics = metrics.snapshot()
+            db_bytes = _db_bytes()
+        finally:
+            os.chdir(original_cwd)
+            server.stop()
+
+    commit, dirty = _git_commit()
+    results = {
+        "suite": "mailtx",
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "scale": args.scale,
+            "count": count,
+            "seed": args.seed,
+            "queries": args.queries,
+            "ollama_latency_ms": args.ollama_latency_ms,
+            "gmail_latency_ms": args.gmail_latency_ms,
+            "precision": args.precision,
+            "body_codec": args.body_codec,
+            "shard_by": args.shard_by,
+        },
+        "db_bytes": db_bytes,
+        "ollama_requests": server.requests,
+        "stages": stages,
+        "metrics": stage_metrics,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
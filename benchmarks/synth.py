@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import base64
+import random
+import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+# Fixed anchor so that the same seed always yields the same mailbox,
+# regardless of the day the benchmark is run.
+ANCHOR_DATE = datetime.datetime(2025, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+SPAN_DAYS = 365
+
+SCALES = {
+    "1k": 1_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+}
+
+MERCHANTS = [
+    ("Uber", "Transport", "receipts@uber.com"),
+    ("Amazon", "Shopping", "auto-confirm@amazon.com"),
+    ("Netflix", "Subscription", "info@netflix.com"),
+    ("Swiggy", "Food", "noreply@swiggy.in"),
+    ("Starbucks", "Food", "orders@starbucks.com"),
+    ("Spotify", "Subscription", "no-reply@spotify.com"),
+    ("Airbnb", "Travel", "automated@airbnb.com"),
+    ("PG&E", "Utilities", "billing@pge.com"),
+]
+
+NEWSLETTERS = [
+    ("The Morning Brief", "news@morningbrief.com"),
+    ("Dev Weekly", "hello@devweekly.io"),
+    ("Garden Club", "club@gardenclub.org"),
+    ("Deals Daily", "promo@dealsdaily.com"),
+]
+
+CURRENCIES = ["USD", "USD", "USD", "EUR", "INR"]
+
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Priya", "Chen", "Maria", "Noah", "Aisha"]
+
+WORDS = (
+    "update weekly market team product launch review story garden travel "
+    "recipe code release notes community event offer member season guide"
+).split()
+
+# kind -> relative weight. Roughly 40% receipts, 60% other mail.
+KINDS = [
+    ("receipt_plain", 15),
+    ("receipt_html", 10),
+    ("receipt_multipart", 15),
+    ("newsletter_plain", 20),
+    ("newsletter_html", 20),
+    ("newsletter_multipart", 20),
+]
+
+def message_id(index):
+    """Gmail-style message id for the synthetic message at `index`."""
+    return f"syn{index:08x}"
+
+def _rng(seed, index):
+    # One RNG per message keeps generation deterministic and random-access,
+    # so the fake Gmail service can regenerate any message on demand.
+    return random.Random(f"{seed}:{index}")
+
+def _pick_kind(rng):
+    total = sum(w for _, w in KINDS)
+    r = rng.uniform(0, total)
+    for kind, weight in KINDS:
+        r -= weight
+        if r <= 0:
+            return kind
+    return KINDS[-1][0]
+
+def _receipt(rng):
+    merchant, category, sender = rng.choice(MERCHANTS)
+    currency = rng.choice(CURRENCIES)
+    amount = round(rng.uniform(2, 400), 2)
+    order_no = f"{rng.randint(100, 999)}-{rng.randint(1000000, 9999999)}"
+    name = rng.choice(FIRST_NAMES)
+    subject = f"Your {merchant} receipt for order {order_no}"
+    lines = [
+        f"Hi {name},",
+        f"Thanks for your purchase from {merchant}.",
+        f"Order number: {order_no}",
+        f"Category: {category}",
+        f"Total: {amount:.2f} {currency}",
+        "This payment has been charged to your card ending in "
+        f"{rng.randint(1000, 9999)}.",
+    ]
+    return merchant, sender, subject, lines
+
+def _newsletter(rng):
+    title, sender = rng.choice(NEWSLETTERS)
+    issue = rng.randint(1, 500)
+    subject = f"{title} #{issue}: {' '.join(rng.sample(WORDS, 3))}"
+    lines = [f"Welcome to issue {issue} of {title}."]
+    for _ in range(rng.randint(4, 12)):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + ".")
+    lines.append("Unsubscribe at any time from your settings page.")
+    return title, sender, subject, lines
+
+def _to_html(lines):
+    body = "".join(f"<p>{line}</p>" for line in lines)
+    return f"<html><body><div class=\"content\">{body}</div></body></html>"
+
+def make_message(index, seed=0):
+    """
+    Builds the synthetic RFC 822 message at `index` for the given seed.
+    Returns (message_id, raw_bytes).
+    """
+    rng = _rng(seed, index)
+    kind = _pick_kind(rng)
+
+    if kind.startswith("receipt"):
+        display, sender, subject, lines = _receipt(rng)
+    else:
+        display, sender, subject, lines = _newsletter(rng)
+
+    sent = ANCHOR_DATE - datetime.timedelta(seconds=rng.randint(0, SPAN_DAYS * 86400))
+
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = f"{display} <{sender}>"
+    msg["To"] = "me@example.com"
+    msg["Date"] = format_datetime(sent)
+    msg["Message-ID"] = f"<{message_id(index)}.{seed}@synthetic.mailtx>"
+
+    plain = "\n".join(lines)
+    if kind.endswith("_plain"):
+        msg.set_content(plain)
+    elif kind.endswith("_html"):
+        msg.set_content(_to_html(lines), subtype="html")
+    else:
+        msg.set_content(plain)
+        msg.add_alternative(_to_html(lines), subtype="html")
+
+    return message_id(index), msg.as_bytes()
+
+def gmail_raw_record(index, seed=0):
+    """The message at `index` in the shape returned by Gmail's `format='raw'`."""
+    msg_id, raw = make_message(index, seed)
+    return {
+        "id": msg_id,
+        "threadId": msg_id,
+        "raw": base64.urlsafe_b64encode(raw).decode("ascii").rstrip("="),
+    }
+
+def write_raw_files(folder_path, count, seed=0):
+    """
+    Writes `count` synthetic messages as Gmail raw JSON files, the same layout
+    `ingest.download_recent_emails` produces. Existing files are kept, so a
+    mailbox can be generated once and re-used across benchmark runs.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    written = 0
+    for i in range(count):
+        file_path = os.path.join(folder_path, f"{message_id(i)}.json")
+        if os.path.exists(file_path):
+            continue
+        with open(file_path, "w") as f:
+            json.dump(gmail_raw_record(i, seed), f)
+        written += 1
+    return written
+
+def write_mbox(path, count, seed=0):
+    """
+    Writes `count` synthetic messages as one mboxrd file, the format of a
+    Gmail Takeout export.
+    """
+    with open(path, "wb") as f:
+        for i in range(count):
+            _, raw = make_message(i, seed)
+            raw = re.sub(rb"^(>*From )", rb">\1", raw.replace(b"\r\n", b"\n"), flags=re.MULTILINE)
+            f.write(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2025\n")
+            f.write(raw)
+            if not raw.endswith(b"\n"):
+                f.write(b"\n")
+            f.write(b"\n")
+
+def parse_scale(value):
+    """Accepts a named scale ('1k', '100k', '1m') or a plain integer."""
+    key = str(value).lower()
+    if key in SCALES:
+        return SCALES[key]
+    return int(key)
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic mailbox")
+    arg_parser.add_argument("out_dir", help="Directory to write raw JSON files to")
+    arg_parser.add_argument("--scale", default="1k", help="1k, 100k, 1m or a message count")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    n = write_raw_files(args.out_dir, parse_scale(args.scale), args.seed)
+    print(f"Wrote {n} messages to {args.out_dir}")
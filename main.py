@@ -5,20 +5,33 @@ import os
 # Add src to path to allow importing spend package
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
-from mailtx import ingest, parser, embed, ledger, query_engine, db
+from mailtx import ingest, parser, importer, embed, ledger, query_engine, search, bodystore, report, shards, db, metrics
 
 def main():
     # Ensure database is initialized
     db.init_db()
 
     parser_arg = argparse.ArgumentParser(description="Local-first AI Spend Analyzer")
+    parser_arg.add_argument("--metrics-json", metavar="PATH", help="Write stage timings, counters and histograms as JSON")
+    parser_arg.add_argument("--metrics-prom", metavar="PATH", help="Write metrics in Prometheus text format (e.g. for a textfile collector)")
+    parser_arg.add_argument("--metrics-port", type=int, metavar="PORT", help="Serve Prometheus metrics on this port while the command runs")
+    parser_arg.add_argument("--profile", metavar="PATH", help="Run under cProfile and save stats to PATH")
     subparsers = parser_arg.add_subparsers(dest="command", help="Available commands")
 
 
     ingest_parser = subparsers.add_parser("ingest", help="Download and parse emails")
     ingest_parser.add_argument("--days", type=int, default=90, help="Number of days to look back (default: 90)")
 
-    subparsers.add_parser("embed", help="Generate embeddings for emails")
+    import_parser = subparsers.add_parser("import", help="Bulk import an mbox file or Maildir directory")
+    import_parser.add_argument("path", type=str, help="mbox file (e.g. Gmail Takeout) or Maildir root")
+    import_parser.add_argument("--format", choices=["auto", "mbox", "maildir"], default="auto", help="Input format (default: auto)")
+    import_parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start from the beginning")
+
+    embed_parser = subparsers.add_parser("embed", help="Generate embeddings for emails")
+    embed_parser.add_argument("--precision", choices=["float32", "float16", "int8"], help="Storage precision for new vectors, saved for later runs (default: float32)")
+    embed_parser.add_argument("--requantize", action="store_true", help="Re-encode all stored vectors at --precision")
+    embed_parser.add_argument("--report", action="store_true", help="Report memory footprint and recall of each precision vs float32")
 
 
     subparsers.add_parser("extract", help="Extract transactions from emails")
@@ -26,17 +39,75 @@ def main():
     ask_parser = subparsers.add_parser("ask", help="Ask a natural language question")
     ask_parser.add_argument("query", type=str, help="The question to ask (e.g., 'How much spent on Uber?')")
 
+    search_parser = subparsers.add_parser("search", help="Hybrid keyword + semantic search over emails")
+    search_parser.add_argument("query", type=str, help="Keywords or a description (e.g., 'order 112-3456789')")
+    search_parser.add_argument("--top-k", type=int, default=10, help="Number of results (default: 10)")
+    search_parser.add_argument("--since", help="Only emails on or after this date (YYYY-MM-DD)")
+    search_parser.add_argument("--until", help="Only emails on or before this date (YYYY-MM-DD)")
+    search_parser.add_argument("--sender", help="Only emails whose sender contains this text")
+
+    report_parser = subparsers.add_parser("report", help="Spending breakdowns computed in one pass over the ledger")
+    report_parser.add_argument("--by", default=",".join(report.DIMENSIONS), help=f"Comma-separated breakdowns (default: {','.join(report.DIMENSIONS)})")
+    report_parser.add_argument("--since", help="Only transactions on or after this date (YYYY-MM-DD)")
+    report_parser.add_argument("--until", help="Only transactions on or before this date (YYYY-MM-DD)")
+    report_parser.add_argument("--format", choices=["json", "csv"], default="json", help="Output format (default: json)")
+    report_parser.add_argument("--output", help="Write the report to this file instead of stdout")
+
+    compress_parser = subparsers.add_parser("compress", help="Compress stored email bodies")
+    compress_parser.add_argument("--codec", choices=["none", "zlib", "zstd"], help="Codec for stored and new bodies ('none' decompresses)")
+    compress_parser.add_argument("--level", type=int, help="Compression level (default: 6 for zlib, 3 for zstd)")
+    compress_parser.add_argument("--train-dict", action="store_true", help="Train a zstd dictionary on a sample of bodies")
+    compress_parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM after re-encoding")
+
+    shard_parser = subparsers.add_parser("shard", help="Split the database into one file per year or quarter")
+    shard_parser.add_argument("--by", choices=list(shards.LAYOUTS), help="Move existing data to this layout ('none' merges shards back)")
+    shard_parser.add_argument("--freeze", metavar="PERIOD", help="Make a shard read-only (e.g. 2023 or 2023Q4)")
+    shard_parser.add_argument("--thaw", metavar="PERIOD", help="Make a frozen shard writable again")
+    shard_parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM of mailtx.db after moving data")
+
     args = parser_arg.parse_args()
 
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    try:
+        if args.profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            profiler.runcall(run_command, args, parser_arg)
+            profiler.dump_stats(args.profile)
+            print(f"\nProfile saved to {args.profile}. Top functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        else:
+            run_command(args, parser_arg)
+    finally:
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+
+def run_command(args, parser_arg):
     if args.command == "ingest":
         print(f"Starting ingestion for last {args.days} days...")
         ingest.download_recent_emails(days=args.days)
         print("\nStarting parsing...")
         parser.process_raw_files()
         
+    elif args.command == "import":
+        print(f"Importing {args.path}...")
+        importer.import_path(args.path, fmt=args.format, workers=args.workers, restart=args.restart)
+
     elif args.command == "embed":
-        print("Generating embeddings...")
-        embed.generate_embeddings()
+        if args.precision:
+            embed.set_precision(args.precision)
+        if args.report:
+            embed.precision_report()
+        elif args.requantize:
+            embed.requantize(embed.stored_precision())
+        else:
+            print("Generating embeddings...")
+            embed.generate_embeddings()
         
     elif args.command == "extract":
         print("Building ledger (extracting transactions)...")
@@ -50,6 +121,46 @@ def main():
             print("\n" + query_engine.format_result(results, params))
         else:
             print("Could not understand the query.")
+
+    elif args.command == "report":
+        dims = [d.strip() for d in args.by.split(",") if d.strip()]
+        unknown = [d for d in dims if d not in report.DIMENSIONS]
+        if unknown:
+            parser_arg.error(f"unknown breakdowns: {', '.join(unknown)}")
+        output = report.generate_report(dims, start_date=args.since, end_date=args.until, fmt=args.format)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+            print(f"Report written to {args.output}")
+        else:
+            print(output)
+
+    elif args.command == "compress":
+        if args.codec:
+            try:
+                bodystore.compress_bodies(args.codec, level=args.level, train_dict=args.train_dict,
+                                          vacuum=not args.no_vacuum)
+            except RuntimeError as e:
+                print(f"Error: {e}")
+        else:
+            bodystore.body_stats()
+
+    elif args.command == "shard":
+        try:
+            if args.by:
+                shards.set_layout(args.by, vacuum=not args.no_vacuum)
+            if args.freeze:
+                shards.set_frozen(args.freeze, True)
+            if args.thaw:
+                shards.set_frozen(args.thaw, False)
+        except ValueError as e:
+            print(e)
+        shards.list_shards()
+
+    elif args.command == "search":
+        results = search.search(args.query, top_k=args.top_k, start_date=args.since,
+                                end_date=args.until, sender=args.sender)
+        print(search.format_results(results))
             
     else:
         parser_arg.print_help()
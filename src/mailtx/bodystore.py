@@ -0,0 +1,147 @@
+import time
+import sqlite3
+import datetime
+from .db import get_db_connection, set_setting, DB_PATH
+from . import compression
+from . import metrics
+from . import shards
+
+# Bodies sampled to train a zstd dictionary.
+DICT_SAMPLE_SIZE = 5000
+
+# Rows re-encoded per transaction.
+BATCH_SIZE = 1000
+
+def measure(conn):
+    """
+    Database size, stored body bytes and a cold-ish full scan of body_text
+    through the row accessor (so decompression cost is included).
+    """
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    stored = conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(body_text AS BLOB))), 0) FROM emails").fetchone()[0]
+
+    start = time.perf_counter()
+    rows = 0
+    text_bytes = 0
+    for row in conn.execute("SELECT body_text FROM emails"):
+        rows += 1
+        text_bytes += len((row['body_text'] or "").encode('utf-8'))
+    seconds = time.perf_counter() - start
+
+    return {
+        'db_bytes': page_count * page_size,
+        'stored_body_bytes': stored,
+        'text_bytes': text_bytes,
+        'rows': rows,
+        'scan_seconds': seconds,
+        'scan_rows_per_sec': rows / seconds if seconds else None,
+    }
+
+def print_stats(stats, label):
+    ratio = stats['text_bytes'] / stats['stored_body_bytes'] if stats['stored_body_bytes'] else 0
+    rate = stats['scan_rows_per_sec'] or 0
+    print(f"{label}: db {stats['db_bytes'] / 1e6:.2f} MB, bodies {stats['stored_body_bytes'] / 1e6:.2f} MB "
+          f"(ratio {ratio:.2f}x), scan {stats['rows']} rows in {stats['scan_seconds']:.3f}s ({rate:.0f} rows/s)")
+
+def _train(conn):
+    rows = conn.execute("SELECT body_text FROM emails ORDER BY RANDOM() LIMIT ?", (DICT_SAMPLE_SIZE,)).fetchall()
+    samples = [row['body_text'] for row in rows]
+    try:
+        dict_id, data = compression.train_dictionary(samples)
+    except Exception as e:
+        # zstd needs a reasonable number of samples to train on
+        print(f"Could not train a dictionary ({e}); compressing without one.")
+        return None
+    conn.execute("INSERT OR REPLACE INTO body_dicts (id, data, created_at) VALUES (?, ?, ?)",
+                 (dict_id, data, datetime.datetime.now().isoformat(timespec='seconds')))
+    print(f"Trained a {len(data) // 1024} KB dictionary on {len(samples)} bodies.")
+    return dict_id
+
+@metrics.stage("compress")
+def compress_bodies(codec, level=None, train_dict=False, vacuum=True):
+    """
+    Sets the body codec for the database and re-encodes every stored body
+    with it ('none' decompresses them back to TEXT). New emails are stored
+    with the same codec. Prints size and scan throughput before and after.
+
+    With a sharded layout each writable shard is re-encoded (and trains its
+    own dictionary); mailtx.db keeps the codec for shards created later.
+    Returns [(before, after)] per database.
+    Raises RuntimeError, before changing anything, if the codec is unavailable.
+    """
+    # checked first: a saved codec that can't be loaded would break every later insert
+    compression.require_codec(codec)
+
+    conn = get_db_connection()
+    if shards.get_layout(conn) != "none":
+        set_setting(conn, 'body_codec', codec)
+        set_setting(conn, 'body_level', level)
+        set_setting(conn, 'body_dict_id', None)
+        conn.commit()
+    conn.close()
+
+    results = []
+    for db_path, _ in shards.databases(writable=True):
+        if db_path != DB_PATH:
+            print(f"{db_path}:")
+        results.append(_compress_database(db_path, codec, level, train_dict, vacuum))
+    return results
+
+def _compress_database(db_path, codec, level, train_dict, vacuum):
+    conn = get_db_connection(db_path)
+    before = measure(conn)
+    print_stats(before, "Before")
+
+    dict_id = None
+    if codec == "zstd" and train_dict:
+        dict_id = _train(conn)
+
+    set_setting(conn, 'body_codec', codec)
+    set_setting(conn, 'body_level', level)
+    set_setting(conn, 'body_dict_id', dict_id)
+    conn.commit()
+    conn._body_codec = None
+
+    last_rowid = 0
+    count = 0
+    while True:
+        rows = conn.execute("SELECT rowid, body_text FROM emails WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                            (last_rowid, BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        conn.executemany("UPDATE emails SET body_text = ? WHERE rowid = ?",
+                         [(conn.encode_body(row['body_text']), row['rowid']) for row in rows])
+        conn.commit()
+        last_rowid = rows[-1]['rowid']
+        count += len(rows)
+        metrics.items("compress", len(rows))
+    print(f"Re-encoded {count} bodies with {codec}.")
+
+    # dictionaries no longer referenced by any setting
+    conn.execute("DELETE FROM body_dicts WHERE id IS NOT ?", (dict_id,))
+    conn.commit()
+
+    if vacuum:
+        print("Vacuuming...")
+        conn.execute("VACUUM")
+
+    after = measure(conn)
+    print_stats(after, "After")
+    conn.close()
+    return before, after
+
+def body_stats():
+    results = []
+    for db_path, read_only in shards.databases():
+        conn = get_db_connection(db_path, read_only)
+        try:
+            stats = measure(conn)
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+        finally:
+            conn.close()
+        print_stats(stats, "Current" if db_path == DB_PATH else db_path)
+        results.append(stats)
+    return results
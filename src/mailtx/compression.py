@@ -0,0 +1,108 @@
+import zlib
+import struct
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional: `uv pip install zstandard`
+    zstandard = None
+
+CODECS = ("none", "zlib", "zstd")
+
+# Compressed bodies are stored as BLOBs: MAGIC, a codec byte, the zstd
+# dictionary id (0 for none) and the payload. Plain TEXT bodies are left as is,
+# so compressed and uncompressed rows can coexist.
+MAGIC = b"MTZ1"
+_CODEC_BYTES = {"zlib": b"z", "zstd": b"s"}
+_CODEC_BY_BYTE = {v: k for k, v in _CODEC_BYTES.items()}
+_DICT_ID = struct.Struct(">I")
+_HEADER = len(MAGIC) + 1 + _DICT_ID.size
+
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+
+# Receipts and newsletters are mostly 1-10 KB, too small to compress well
+# alone; a dictionary trained on a sample of bodies supplies the shared context.
+DICT_SIZE = 112 * 1024
+
+# zstd (de)compressor objects are not thread-safe, so each thread keeps its own.
+_local = threading.local()
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd compression needs the 'zstandard' package (uv pip install zstandard).")
+
+def require_codec(codec):
+    """Raises RuntimeError if `codec` cannot be used in this environment."""
+    if codec == "zstd":
+        _require_zstd()
+
+def is_compressed(value):
+    return isinstance(value, bytes) and value[:len(MAGIC)] == MAGIC
+
+def train_dictionary(samples, size=DICT_SIZE):
+    """
+    Trains a zstd dictionary on sample body texts.
+    Returns (dict_id, dict_bytes); the id is the one zstd embeds in it.
+    """
+    _require_zstd()
+    encoded = [s.encode("utf-8") for s in samples if s]
+    trained = zstandard.train_dictionary(size, encoded)
+    return trained.dict_id(), trained.as_bytes()
+
+def _zstd(kind, level, dict_id_, dict_data):
+    cache = getattr(_local, kind, None)
+    if cache is None:
+        cache = {}
+        setattr(_local, kind, cache)
+    key = (dict_id_, level)
+    obj = cache.get(key)
+    if obj is None:
+        zdict = zstandard.ZstdCompressionDict(dict_data) if dict_data else None
+        if kind == "compressors":
+            obj = zstandard.ZstdCompressor(level=level, dict_data=zdict)
+        else:
+            obj = zstandard.ZstdDecompressor(dict_data=zdict)
+        cache[key] = obj
+    return obj
+
+def compress_body(text, codec, level=None, dictionary=None):
+    """
+    Compresses body text for storage. Returns `text` unchanged for the
+    'none' codec, or when compressing would not make it smaller (short
+    bodies), otherwise a BLOB in the MAGIC format. `dictionary` is a
+    (dict_id, dict_bytes) pair from `train_dictionary`, zstd only.
+    """
+    if codec == "none" or text is None:
+        return text
+    level = level or DEFAULT_LEVELS[codec]
+    raw = text.encode("utf-8")
+    if codec == "zlib":
+        blob = MAGIC + _CODEC_BYTES["zlib"] + _DICT_ID.pack(0) + zlib.compress(raw, level)
+    else:
+        _require_zstd()
+        dict_id_, dict_data = dictionary or (0, None)
+        payload = _zstd("compressors", level, dict_id_, dict_data).compress(raw)
+        blob = MAGIC + _CODEC_BYTES["zstd"] + _DICT_ID.pack(dict_id_) + payload
+    return blob if len(blob) < len(raw) else text
+
+def blob_dict_id(value):
+    """The dictionary a compressed body needs (0 if none)."""
+    return _DICT_ID.unpack_from(value, len(MAGIC) + 1)[0]
+
+def decompress_body(value, load_dict=None):
+    """
+    Returns the text of a stored body. Plain text passes through.
+    `load_dict(dict_id)` must return the dictionary bytes for zstd bodies
+    compressed with a dictionary.
+    """
+    if not is_compressed(value):
+        return value
+    codec = _CODEC_BY_BYTE[value[len(MAGIC):len(MAGIC) + 1]]
+    payload = value[_HEADER:]
+    if codec == "zlib":
+        return zlib.decompress(payload).decode("utf-8")
+
+    _require_zstd()
+    dict_id_ = blob_dict_id(value)
+    dict_data = load_dict(dict_id_) if dict_id_ else None
+    return _zstd("decompressors", 0, dict_id_, dict_data).decompress(payload).decode("utf-8")
@@ -1,13 +1,85 @@
 import sqlite3
 import os
+import pathlib
+from . import compression
 
 DB_PATH = "mailtx.db"
 
-def get_db_connection(db_path=DB_PATH):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+# zstd dictionaries by id; ids are derived from the dictionary content.
+_dicts = {}
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection that compresses email bodies per the database's
+    settings and decompresses them transparently when rows are read.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._body_codec = None
+
+    def body_codec(self):
+        """(codec, level, dictionary) configured for new bodies."""
+        if self._body_codec is None:
+            try:
+                codec = get_setting(self, 'body_codec', 'none')
+                level = get_setting(self, 'body_level')
+                dict_id = get_setting(self, 'body_dict_id')
+            except sqlite3.OperationalError:
+                # settings table not created yet (init_db not run)
+                codec, level, dict_id = 'none', None, None
+            dictionary = (int(dict_id), self.load_dict(int(dict_id))) if dict_id else None
+            self._body_codec = (codec, int(level) if level else None, dictionary)
+        return self._body_codec
+
+    def encode_body(self, text):
+        codec, level, dictionary = self.body_codec()
+        return compression.compress_body(text, codec, level, dictionary)
+
+    def decode_body(self, value):
+        return compression.decompress_body(value, self.load_dict)
+
+    def load_dict(self, dict_id):
+        data = _dicts.get(dict_id)
+        if data is None:
+            row = sqlite3.Connection.execute(self, "SELECT data FROM body_dicts WHERE id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Compression dictionary {dict_id} not found")
+            data = _dicts[dict_id] = row[0]
+        return data
+
+def _row_factory(cursor, row):
+    # Row accessor: compressed bodies come back as plain text.
+    if any(compression.is_compressed(value) for value in row):
+        decode = cursor.connection.decode_body
+        row = tuple(decode(value) if compression.is_compressed(value) else value for value in row)
+    return sqlite3.Row(cursor, row)
+
+def get_db_connection(db_path=DB_PATH, read_only=False):
+    if read_only:
+        # frozen shards: the file never changes, so SQLite can skip locking
+        uri = pathlib.Path(db_path).absolute().as_uri() + "?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, factory=Connection)
+    else:
+        conn = sqlite3.connect(db_path, factory=Connection)
+    conn.row_factory = _row_factory
+    # Used by the FTS triggers, which must index the text, not the BLOB.
+    conn.create_function("mailtx_body", 1, conn.decode_body, deterministic=True)
     return conn
 
+def get_setting(conn, key, default=None):
+    row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_setting(conn, key, value):
+    if value is None:
+        conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+    else:
+        conn.execute('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, str(value)))
+
 def init_db(db_path=DB_PATH):
     """
     Initialize the database with the required schema.
@@ -15,7 +87,26 @@ def init_db(db_path=DB_PATH):
     conn = get_db_connection(db_path)
     c = conn.cursor()
 
+    # key/value settings (e.g. body compression codec)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # trained zstd dictionaries for compressed bodies
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS body_dicts (
+            id INTEGER PRIMARY KEY,
+            data BLOB,
+            created_at TEXT
+        )
+    ''')
+
     # emails table
+    # body_text holds TEXT, or a compressed BLOB (see compression.py) that
+    # get_db_connection() rows decode transparently
     c.execute('''
         CREATE TABLE IF NOT EXISTS emails (
             id TEXT PRIMARY KEY,
@@ -37,6 +128,11 @@ def init_db(db_path=DB_PATH):
         )
     ''')
 
+    # float32 copy of quantized vectors, used for re-ranking (added after v0)
+    columns = {row['name'] for row in c.execute("PRAGMA table_info(embeddings)")}
+    if 'vector_full' not in columns:
+        c.execute('ALTER TABLE embeddings ADD COLUMN vector_full BLOB')
+
     #  tx table
     c.execute('''
         CREATE TABLE IF NOT EXISTS tx (
@@ -53,36 +149,124 @@ def init_db(db_path=DB_PATH):
         )
     ''')
 
+    # tx_version changes whenever the ledger does; report.py uses it to
+    # invalidate its on-disk snapshot
+    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('tx_version', 0)")
+    for event, name in (("INSERT", "ai"), ("DELETE", "ad"), ("UPDATE", "au")):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tx_version_{name} AFTER {event} ON tx BEGIN
+              UPDATE settings SET value = value + 1 WHERE key = 'tx_version';
+            END;
+        ''')
+
+    # near-duplicate signatures (see neardup.py): MinHash as a BLOB of
+    # uint32, cluster_id is the id of the first email seen in the cluster.
+    # The v0 SimHash table is dropped; index_missing() rebuilds signatures.
+    c.execute('DROP TABLE IF EXISTS email_simhash')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS email_minhash (
+            email_id TEXT PRIMARY KEY,
+            signature BLOB,
+            cluster_id TEXT,
+            FOREIGN KEY(email_id) REFERENCES emails(id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_email_minhash_cluster ON email_minhash(cluster_id)')
+
+    # LSH buckets of cluster representatives, one row per band
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS minhash_buckets (
+            bucket INTEGER,
+            email_id TEXT,
+            PRIMARY KEY (bucket, email_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # resumable mbox imports: byte offset of the next message
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            position INTEGER,
+            updated_at TEXT
+        )
+    ''')
+
+    # Maildir messages already imported, by unique file name (see importer.maildir_key)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS import_seen (
+            source TEXT,
+            key TEXT,
+            PRIMARY KEY (source, key)
+        ) WITHOUT ROWID
+    ''')
+
+    # shard catalog (see shards.py); empty unless the layout is sharded
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS shards (
+            period TEXT PRIMARY KEY,
+            path TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            read_only INTEGER DEFAULT 0,
+            tx_start_date TEXT,
+            tx_end_date TEXT
+        )
+    ''')
+
+    # range of the shard's tx_date values (shards.refresh_tx_dates); tx rows
+    # live with their email, so it can reach outside the shard's period
+    columns = {row['name'] for row in c.execute("PRAGMA table_info(shards)")}
+    if 'tx_start_date' not in columns:
+        c.execute('ALTER TABLE shards ADD COLUMN tx_start_date TEXT')
+        c.execute('ALTER TABLE shards ADD COLUMN tx_end_date TEXT')
+
     # FTS5 on emails if possible
     try:
-        # virtual table for FTS that indexes the emails table content
-        # We use the 'content' option to point to the existing emails table
+        # Contentless FTS index over the emails text. It cannot point at the
+        # emails table as external content because body_text may be stored
+        # compressed; the triggers index the decompressed text instead
+        # (mailtx_body() is registered by get_db_connection).
+        row = c.execute("SELECT sql FROM sqlite_master WHERE name = 'emails_fts'").fetchone()
+        rebuild_fts = row is None or "content=''" not in row['sql']
+        if row is not None and rebuild_fts:
+            # v0 index used content='emails'; replace it
+            for trigger in ('emails_ai', 'emails_ad', 'emails_au'):
+                c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            c.execute('DROP TABLE emails_fts')
+
         c.execute('''
             CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
                 subject, 
                 body_text, 
-                content='emails', 
-                content_rowid='rowid'
+                content=''
             )
         ''')
 
         # Triggers to keep FTS index up to date with the emails table
         c.execute('''
             CREATE TRIGGER IF NOT EXISTS emails_ai AFTER INSERT ON emails BEGIN
-              INSERT INTO emails_fts(rowid, subject, body_text) VALUES (new.rowid, new.subject, new.body_text);
+              INSERT INTO emails_fts(rowid, subject, body_text) VALUES (new.rowid, new.subject, mailtx_body(new.body_text));
             END;
         ''')
         c.execute('''
             CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
-              INSERT INTO emails_fts(emails_fts, rowid, subject, body_text) VALUES('delete', old.rowid, old.subject, old.body_text);
+              INSERT INTO emails_fts(emails_fts, rowid, subject, body_text) VALUES('delete', old.rowid, old.subject, mailtx_body(old.body_text));
             END;
         ''')
         c.execute('''
-            CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
-              INSERT INTO emails_fts(emails_fts, rowid, subject, body_text) VALUES('delete', old.rowid, old.subject, old.body_text);
-              INSERT INTO emails_fts(rowid, subject, body_text) VALUES (new.rowid, new.subject, new.body_text);
+            CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE OF subject, body_text ON emails
+            WHEN old.subject IS NOT new.subject OR mailtx_body(old.body_text) IS NOT mailtx_body(new.body_text)
+            BEGIN
+              INSERT INTO emails_fts(emails_fts, rowid, subject, body_text) VALUES('delete', old.rowid, old.subject, mailtx_body(old.body_text));
+              INSERT INTO emails_fts(rowid, subject, body_text) VALUES (new.rowid, new.subject, mailtx_body(new.body_text));
             END;
         ''')
+
+        if rebuild_fts:
+            c.execute('''
+                INSERT INTO emails_fts(rowid, subject, body_text)
+                SELECT rowid, subject, mailtx_body(body_text) FROM emails
+            ''')
         
     except sqlite3.OperationalError:
         # FTS5 might not be available in the sqlite3 build
@@ -1,33 +1,138 @@
 import sqlite3
-import json
 import numpy as np
 import ollama
-from .db import get_db_connection
+from .db import get_db_connection, get_setting, set_setting
+from . import metrics
+from . import vectors
+from . import shards
 
 MODEL_NAME = "nomic-embed-text"
 
-def generate_embeddings():
+# Precision new vectors are stored at: 'float32', 'float16' or 'int8'.
+# The `vector_precision` setting in mailtx.db overrides it (see set_precision).
+VECTOR_PRECISION = "float32"
+
+# Also store a float32 copy (vector_full) of quantized vectors, used to
+# re-rank the top candidates in find_similar. Costs disk, not RAM.
+KEEP_FULL_PRECISION = True
+
+# find_similar re-ranks top_k * RERANK_FACTOR quantized candidates.
+RERANK_FACTOR = 4
+
+# Packed vector matrices, keyed by database file and embeddings table state.
+_index_cache = {}
+
+def embed_text(text, op="embed_query"):
     """
-    Generates embeddings for emails that don't have them yet.
+    Embeds a single piece of text. Returns a float numpy array.
     """
+    response = metrics.ollama_call(ollama.embeddings, op, MODEL_NAME, prompt=text)
+    return np.array(response['embedding'])
+
+# Saved vector_precision setting, loaded on first use.
+_precision = None
+
+def stored_precision():
+    """Precision new vectors are stored at: the saved setting, else VECTOR_PRECISION."""
+    global _precision
+    if _precision is None:
+        conn = get_db_connection()
+        _precision = get_setting(conn, 'vector_precision', VECTOR_PRECISION)
+        conn.close()
+    return _precision
+
+def set_precision(precision):
+    """Saves the precision later runs store new vectors at."""
+    global _precision
+    if precision not in vectors.PRECISIONS:
+        raise ValueError(f"Unknown vector precision: {precision}")
     conn = get_db_connection()
+    set_setting(conn, 'vector_precision', precision)
+    conn.commit()
+    conn.close()
+    _precision = precision
+
+def encode_for_storage(vector, precision=None):
+    """
+    Returns (vector_blob, vector_full_blob) for the embeddings table, at
+    `precision` or else the stored one. vector_full_blob is None unless the
+    vector is quantized.
+    """
+    precision = precision or stored_precision()
+    vector_blob = vectors.encode_vector(vector, precision)
+    if precision != "float32" and KEEP_FULL_PRECISION:
+        return vector_blob, vectors.encode_vector(vector, "float32")
+    return vector_blob, None
+
+def cosine_similarities(query_vector, matrix):
+    """
+    Cosine similarity of `query_vector` against each row of `matrix`.
+    Zero-norm rows score 0.
+    """
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+    dots = matrix @ query_vector
+    return np.divide(dots, norms, out=np.zeros_like(dots, dtype=float), where=norms != 0)
+
+@metrics.stage("embed")
+def generate_embeddings():
+    """
+    Generates embeddings for emails that don't have them yet, in each
+    writable shard when the layout is sharded.
+    """
+    for db_path, _ in shards.databases(writable=True):
+        _embed_database(db_path)
+    print("Embedding generation complete.")
+
+def _embed_database(db_path):
+    conn = get_db_connection(db_path)
     c = conn.cursor()
 
     # fetch emails that are not in the embeddings table
     # We use a LEFT JOIN or NOT IN clause
+    # Near-duplicate cluster representatives go first so the rest of each
+    # cluster can re-use their vector instead of calling the model.
     c.execute('''
-        SELECT e.id, e.subject, e.body_text 
+        SELECT e.id, e.subject, e.body_text, s.cluster_id
         FROM emails e
         LEFT JOIN embeddings emb ON e.id = emb.email_id
+        LEFT JOIN email_minhash s ON s.email_id = e.id
         WHERE emb.email_id IS NULL
+        ORDER BY s.cluster_id IS NOT NULL AND s.cluster_id != e.id
     ''')
     
     emails_to_process = c.fetchall()
     total = len(emails_to_process)
     print(f"Found {total} emails to embed.")
 
+    # cluster_id -> (vector, vector_full) blobs already stored for that cluster
+    cluster_vectors = {}
+    reused_count = 0
+
     for i, row in enumerate(emails_to_process):
         email_id = row['id']
+        cluster_id = row['cluster_id']
+
+        if cluster_id:
+            blobs = cluster_vectors.get(cluster_id)
+            if blobs is None:
+                c.execute('''
+                    SELECT emb.vector, emb.vector_full FROM embeddings emb
+                    JOIN email_minhash s ON s.email_id = emb.email_id
+                    WHERE s.cluster_id = ?
+                    LIMIT 1
+                ''', (cluster_id,))
+                hit = c.fetchone()
+                if hit:
+                    blobs = cluster_vectors[cluster_id] = (hit['vector'], hit['vector_full'])
+            if blobs is not None:
+                c.execute('''
+                    INSERT INTO embeddings (email_id, vector, vector_full)
+                    VALUES (?, ?, ?)
+                ''', (email_id, *blobs))
+                metrics.cache_hit("embed")
+                reused_count += 1
+                continue
+
         subject = row['subject'] or ""
         body = row['body_text'] or ""
         
@@ -38,16 +143,19 @@ def generate_embeddings():
         input_text = f"Subject: {subject}\nBody: {truncated_body}"
         
         try:
-            response = ollama.embeddings(model=MODEL_NAME, prompt=input_text)
+            response = metrics.ollama_call(ollama.embeddings, "embed", MODEL_NAME, prompt=input_text)
             vector = response['embedding']
             
-            # serialize vector to JSON bytes
-            vector_blob = json.dumps(vector).encode('utf-8')
+            # serialize vector at the configured precision
+            blobs = encode_for_storage(vector)
             
             c.execute('''
-                INSERT INTO embeddings (email_id, vector)
-                VALUES (?, ?)
-            ''', (email_id, vector_blob))
+                INSERT INTO embeddings (email_id, vector, vector_full)
+                VALUES (?, ?, ?)
+            ''', (email_id, *blobs))
+            metrics.items("embed")
+            if cluster_id:
+                cluster_vectors[cluster_id] = blobs
             
             if (i + 1) % 10 == 0:
                 print(f"Processed {i + 1}/{total}...")
@@ -55,59 +163,149 @@ def generate_embeddings():
                 
         except Exception as e:
             print(f"Error embedding email {email_id}: {e}")
+            metrics.error("embed")
 
     conn.commit()
     conn.close()
-    print("Embedding generation complete.")
+    if reused_count:
+        print(f"Re-used cluster embeddings for {reused_count} near-duplicate emails.")
+
+def load_index(c):
+    """
+    Returns the packed vector index for the connection's database, re-using
+    the cached one while the embeddings table is unchanged.
+    """
+    db_file = c.execute("PRAGMA database_list").fetchone()['file']
+    state = tuple(c.execute("SELECT COUNT(*), MAX(rowid) FROM embeddings").fetchone())
+    cached = _index_cache.get(db_file)
+    if cached and cached[0] == state:
+        return cached[1]
 
-def find_similar(query_text, top_k=10):
+    c.execute('SELECT email_id, vector FROM embeddings')
+    index = vectors.build_index((row['email_id'], row['vector']) for row in c.fetchall())
+    _index_cache[db_file] = (state, index)
+    return index
+
+def rerank_full_precision(c, query_vector, candidates):
+    """
+    Re-scores (email_id, similarity) candidates with their float32
+    vector_full copies, where stored. Returns the list sorted best first.
+    """
+    ids = [email_id for email_id, _ in candidates]
+    placeholders = ",".join("?" * len(ids))
+    c.execute(f"SELECT email_id, vector_full FROM embeddings WHERE email_id IN ({placeholders}) "
+              "AND vector_full IS NOT NULL", ids)
+    full = {row['email_id']: vectors.decode_vector(row['vector_full']) for row in c.fetchall()}
+    if full:
+        exact_ids = list(full)
+        exact = cosine_similarities(np.asarray(query_vector, dtype=np.float32), np.vstack([full[i] for i in exact_ids]))
+        exact_scores = dict(zip(exact_ids, exact.tolist()))
+        candidates = [(email_id, exact_scores.get(email_id, score)) for email_id, score in candidates]
+    return sorted(candidates, key=lambda x: x[1], reverse=True)
+
+def top_similar(c, query_vector, top_k=10, rerank=True):
+    """
+    Best top_k (email_id, similarity) in the cursor's database.
+    Scores the whole (possibly quantized) vector matrix at once; for
+    quantized indexes the best top_k * RERANK_FACTOR are re-ranked at full
+    precision when `rerank` is set.
+    """
+    index = load_index(c)
+    scores = vectors.score_index(index, query_vector)
+    metrics.items("find_similar", len(index['ids']))
+
+    quantized = index['precision'] != "float32"
+    k = top_k * RERANK_FACTOR if rerank and quantized else top_k
+    similarities = [(index['ids'][i], float(scores[i])) for i in vectors.top_k_indices(scores, k)]
+    if rerank and quantized and similarities:
+        similarities = rerank_full_precision(c, query_vector, similarities)
+    return similarities[:top_k]
+
+@metrics.stage("find_similar")
+def find_similar(query_text, top_k=10, rerank=True):
     """
     Finds emails semantically similar to the query text.
+    With a sharded layout every shard is searched in parallel and the
+    per-shard top_k lists are merged.
     """
     try:
-        query_response = ollama.embeddings(model=MODEL_NAME, prompt=query_text)
-        query_vector = np.array(query_response['embedding'])
+        query_vector = embed_text(query_text)
     except Exception as e:
         print(f"Error generating query embedding: {e}")
         return []
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('SELECT email_id, vector FROM embeddings')
-    rows = c.fetchall()
-    
-    similarities = []
-    
-    for row in rows:
-        email_id = row['email_id']
-        vector_blob = row['vector']
-        
-        try:
-            # deserialize vector
-            vector = np.array(json.loads(vector_blob.decode('utf-8')))
-            
-            # calculate Cosine Similarity
-            # sim = (A . B) / (||A|| * ||B||)
-            dot_product = np.dot(query_vector, vector)
-            norm_a = np.linalg.norm(query_vector)
-            norm_b = np.linalg.norm(vector)
-            
-            if norm_a == 0 or norm_b == 0:
-                similarity = 0
-            else:
-                similarity = dot_product / (norm_a * norm_b)
-                
-            similarities.append((email_id, similarity))
-            
-        except Exception as e:
-            print(f"Error processing vector for {email_id}: {e}")
-            continue
-            
-    conn.close()
-    
-    # sort by similarity descending
+    results = shards.fan_out(lambda c: top_similar(c, query_vector, top_k, rerank), shards.databases())
+    similarities = [hit for shard_hits in results for hit in shard_hits]
     similarities.sort(key=lambda x: x[1], reverse=True)
-    
     return similarities[:top_k]
 
+def requantize(precision):
+    """
+    Rewrites every stored vector at `precision`, keeping (or dropping) the
+    float32 copy per KEEP_FULL_PRECISION, and saves it as the precision for
+    new vectors. Frozen shards are left as they are.
+    """
+    set_precision(precision)
+    count = 0
+    for db_path, _ in shards.databases(writable=True):
+        conn = get_db_connection(db_path)
+        c = conn.cursor()
+        c.execute("SELECT rowid, vector, vector_full FROM embeddings")
+        rows = c.fetchall()
+        for row in rows:
+            vector = vectors.decode_vector(row['vector_full'] or row['vector'])
+            c.execute("UPDATE embeddings SET vector = ?, vector_full = ? WHERE rowid = ?",
+                      (*encode_for_storage(vector, precision), row['rowid']))
+        conn.commit()
+        conn.close()
+        count += len(rows)
+    _index_cache.clear()
+    print(f"Re-encoded {count} vectors as {precision}.")
+
+def precision_report(sample=100, top_k=10, seed=0):
+    """
+    Measures each precision against float32: index memory, and recall@top_k
+    (with and without full-precision re-ranking) for `sample` queries drawn
+    from the stored vectors. Uses vector_full as the reference where stored.
+    """
+    results = shards.fan_out(lambda c: c.execute("SELECT email_id, vector, vector_full FROM embeddings").fetchall(),
+                             shards.databases())
+    rows = [row for shard_rows in results for row in shard_rows]
+    if not rows:
+        print("No embeddings to report on.")
+        return {}
+
+    reference_rows = [(row['email_id'], vectors.encode_vector(vectors.decode_vector(row['vector_full'] or row['vector'])))
+                      for row in rows]
+    if any(row['vector_full'] is None and vectors.blob_precision(row['vector']) in ("float16", "int8") for row in rows):
+        print("Note: some vectors have no float32 copy; their quantized values serve as the reference.")
+
+    reference = vectors.build_index(reference_rows, "float32")
+    full_matrix = reference['matrix']
+    rng = np.random.default_rng(seed)
+    queries = full_matrix[rng.choice(len(full_matrix), size=min(sample, len(full_matrix)), replace=False)]
+    truth = [set(vectors.top_k_indices(vectors.score_index(reference, q), top_k).tolist()) for q in queries]
+
+    report = {}
+    for precision in vectors.PRECISIONS:
+        index = vectors.build_index(reference_rows, precision)
+        recall = 0.0
+        recall_reranked = 0.0
+        for q, expected in zip(queries, truth):
+            scores = vectors.score_index(index, q)
+            recall += len(expected & set(vectors.top_k_indices(scores, top_k).tolist())) / len(expected)
+            candidates = vectors.top_k_indices(scores, top_k * RERANK_FACTOR)
+            exact = cosine_similarities(q, full_matrix[candidates])
+            reranked = candidates[np.argsort(-exact)[:top_k]]
+            recall_reranked += len(expected & set(reranked.tolist())) / len(expected)
+        report[precision] = {
+            'bytes': vectors.index_nbytes(index),
+            'recall': recall / len(queries),
+            'recall_reranked': recall_reranked / len(queries),
+        }
+
+    print(f"{len(rows)} vectors, {len(queries)} sample queries, recall@{top_k} vs float32:")
+    for precision, r in report.items():
+        print(f"  {precision:>8}: {r['bytes'] / 1e6:8.2f} MB  recall {r['recall']:.3f}  "
+              f"re-ranked {r['recall_reranked']:.3f}")
+    return report
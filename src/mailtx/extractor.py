@@ -1,10 +1,16 @@
+import re
 import json
 import ollama
+from . import metrics
 
 # Using llama3.2 as it is efficient and widely available. 
 # You can switch to 'llama3.1' or 'qwen2.5' if preferred.
 MODEL_NAME = "llama3.2" 
 
+# Confidence recorded for transactions copied from a near-duplicate's template
+# rather than extracted by the model.
+TEMPLATE_CONFIDENCE = 0.9
+
 SYSTEM_PROMPT = """You are a data parser. Extract financial details from the email text provided.
 Return ONLY a JSON object. Do not include markdown formatting like ```json ... ```.
 
@@ -18,15 +24,17 @@ Required Keys:
 If the email is NOT a receipt, invoice, or transaction confirmation, return an empty JSON object {}.
 """
 
-def extract_tx_data(email_text):
+def extract_tx_data(email_text, raise_errors=False):
     """
     Extracts transaction data from email text using a local LLM.
     Returns a dict with keys: merchant, amount_cents, currency, date, category.
-    Returns None if extraction fails or no transaction found.
+    Returns None if extraction fails or no transaction found; with
+    `raise_errors` a failure (model unreachable, unparsable output) raises
+    instead, so callers can tell it apart from "not a transaction".
     """
     try:
-        response = ollama.chat(
-            model=MODEL_NAME,
+        response = metrics.ollama_call(
+            ollama.chat, "extract", MODEL_NAME,
             messages=[
                 {'role': 'system', 'content': SYSTEM_PROMPT},
                 {'role': 'user', 'content': email_text},
@@ -47,7 +55,7 @@ def extract_tx_data(email_text):
             if start != -1 and end != -1:
                 data = json.loads(content[start:end])
             else:
-                return None
+                raise ValueError("no JSON object in model output")
 
         # check if empty (not a receipt)
         if not data or 'amount' not in data:
@@ -68,5 +76,68 @@ def extract_tx_data(email_text):
         
     except Exception as e:
         # print(f"Extraction error: {e}") # Optional: uncomment for debugging
+        metrics.error("extract")
+        if raise_errors:
+            raise
         return None
 
+_CURRENCY_CODES = "USD|EUR|GBP|INR|JPY|CAD|AUD|CHF|SGD|AED"
+# Amounts like "1,234.56", optionally with a currency symbol or code on either side.
+_AMOUNT_RE = re.compile(
+    rf"(?P<pre>[$€£₹]|\b(?:{_CURRENCY_CODES})\b)?\s?"
+    r"(?P<amount>\d{1,3}(?:,\d{3})*\.\d{2}|\d+\.\d{2})"
+    rf"\s?(?P<post>\b(?:{_CURRENCY_CODES})\b)?"
+)
+_ISO_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_TOTAL_HINTS = ("total", "amount", "charged", "paid")
+# Hinted lines that are not the amount charged, and lines that certainly are.
+_SUBTOTAL_RE = re.compile(r"\bsub[\s-]?total", re.IGNORECASE)
+_GRAND_TOTAL_RE = re.compile(r"\b(?:grand|order)\s+total\b", re.IGNORECASE)
+_SYMBOL_CURRENCIES = {'$': 'USD', '€': 'EUR', '£': 'GBP', '₹': 'INR'}
+
+def recheck_tx_data(template, email_text, email_date=None):
+    """
+    Cheap extraction for a near-duplicate of an email whose transaction is
+    already known. Merchant and category come from `template` (a tx row or
+    dict); only the amount, currency and date are re-read from this email.
+    The amount is the grand/order total if there is one, else the amount on
+    the lines hinting at a total (subtotals excluded). Returns None when the
+    amount cannot be found confidently, e.g. those lines disagree, so
+    callers can fall back to `extract_tx_data`.
+    """
+    hinted = []
+    for line in email_text.splitlines():
+        if any(h in line.lower() for h in _TOTAL_HINTS) and not _SUBTOTAL_RE.search(line):
+            match = _AMOUNT_RE.search(line)
+            if match:
+                hinted.append((line, match))
+
+    grand = [match for line, match in hinted if _GRAND_TOTAL_RE.search(line)]
+    if grand:
+        match = grand[-1]
+    elif hinted:
+        # e.g. "Total" and "Amount paid" agree; anything else is ambiguous
+        if len({m.group('amount').replace(',', '') for _, m in hinted}) > 1:
+            return None
+        match = hinted[-1][1]
+    else:
+        matches = list(_AMOUNT_RE.finditer(email_text))
+        if len(matches) != 1:
+            return None
+        match = matches[0]
+
+    amount = float(match.group('amount').replace(',', ''))
+    marker = match.group('pre') or match.group('post')
+    currency = _SYMBOL_CURRENCIES.get(marker, marker) or template['currency']
+
+    date_match = _ISO_DATE_RE.search(email_text)
+    tx_date = date_match.group(1) if date_match else email_date
+
+    return {
+        'merchant': template['merchant'],
+        'amount_cents': int(round(amount * 100)),
+        'currency': currency,
+        'date': tx_date,
+        'category': template['category'],
+        'confidence': TEMPLATE_CONFIDENCE
+    }
@@ -0,0 +1,286 @@
+import os
+import re
+import mmap
+import hashlib
+import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .db import get_db_connection
+from . import parser
+from . import metrics
+from . import neardup
+from . import shards
+
+# A batch is handed to one worker; bounded by message count and bytes.
+BATCH_MESSAGES = 500
+BATCH_BYTES = 8 * 1024 * 1024
+
+# Batches in flight per worker. Keeps the pool busy while bounding memory,
+# since parsed bodies wait here until the (single) writer inserts them.
+PREFETCH_PER_WORKER = 4
+
+_MBOXRD_QUOTE_RE = re.compile(rb"^>(>*From )", re.MULTILINE)
+
+# Per-process mmap of the mbox being imported (set by _init_mbox_worker).
+_mbox_map = None
+
+def split_mbox(mm, start=0):
+    """
+    Yields (start, end) byte spans of the messages in a memory-mapped mbox,
+    beginning at offset `start`. Spans include the leading "From " line.
+    Only mm.find() is used, so nothing is copied while scanning.
+    """
+    if start == 0 and mm[:5] != b"From ":
+        pos = mm.find(b"\nFrom ")
+        start = len(mm) if pos == -1 else pos + 1
+    size = len(mm)
+    while start < size:
+        pos = mm.find(b"\nFrom ", start)
+        end = size if pos == -1 else pos + 1
+        yield start, end
+        start = end
+
+def _message_id(source, key, raw_bytes):
+    # Prefer the Message-ID so the same mail imported from Gmail Takeout and
+    # a Maildir backup maps to one row; fall back to the source position.
+    match = re.search(rb"^Message-ID:\s*(<[^>\r\n]+>)", raw_bytes[:16384], re.MULTILINE | re.IGNORECASE)
+    basis = match.group(1) if match else f"{source}:{key}".encode("utf-8")
+    return "imp_" + hashlib.sha1(basis).hexdigest()[:20]
+
+def _parse_message(source, key, raw_bytes, raw_path):
+    """Parses one message into an emails row (or an error string)."""
+    try:
+        subject, from_addr, date_str, body_text = parser.parse_mime_bytes(raw_bytes)
+        # MinHash is computed here so it runs in parallel with other messages
+        signature = neardup.minhash(neardup.signature_text(subject, body_text))
+        return (_message_id(source, key, raw_bytes), parser.parse_date(date_str),
+                from_addr, subject, body_text, raw_path, signature)
+    except Exception as e:
+        return f"Error parsing {raw_path}: {e}"
+
+def _init_mbox_worker(path):
+    global _mbox_map
+    f = open(path, "rb")
+    _mbox_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _parse_mbox_batch(path, spans):
+    results = []
+    for start, end in spans:
+        # Drop the "From " separator line and undo mboxrd ">From " quoting.
+        header_end = _mbox_map.find(b"\n", start, end)
+        if header_end == -1:
+            # truncated "From " line with no message after it
+            continue
+        # the blank line before the next "From " separates messages; keep it
+        # out of the body so content_hash matches the same mail from Gmail
+        body_end = end
+        if _mbox_map[end - 4:end] == b"\r\n\r\n":
+            body_end -= 2
+        elif _mbox_map[end - 2:end] == b"\n\n":
+            body_end -= 1
+        raw_bytes = _MBOXRD_QUOTE_RE.sub(rb"\1", _mbox_map[header_end + 1:body_end])
+        results.append(_parse_message(path, start, raw_bytes, f"{path}#{start}"))
+    return end, results
+
+def _parse_maildir_batch(root, paths):
+    results = []
+    for file_path in paths:
+        try:
+            with open(file_path, "rb") as f:
+                raw_bytes = f.read()
+        except OSError as e:
+            results.append(f"Error reading {file_path}: {e}")
+            continue
+        results.append(_parse_message(root, os.path.relpath(file_path, root), raw_bytes, file_path))
+    return [maildir_key(file_path) for file_path in paths], results
+
+def _batched_spans(spans):
+    batch = []
+    batch_bytes = 0
+    for start, end in spans:
+        batch.append((start, end))
+        batch_bytes += end - start
+        if len(batch) >= BATCH_MESSAGES or batch_bytes >= BATCH_BYTES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+def walk_maildir(root):
+    """
+    Returns message file paths under every cur/ and new/ directory in
+    `root` (including Maildir++ subfolders), in a stable sorted order.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if os.path.basename(dirpath) in ("cur", "new"):
+            paths.extend(os.path.join(dirpath, name) for name in sorted(filenames) if not name.startswith("."))
+    return paths
+
+def maildir_key(file_path):
+    """
+    Unique part of a Maildir file name. It survives the client moving the
+    message from new/ to cur/ and appending ":2,<flags>".
+    """
+    return os.path.basename(file_path).split(":", 1)[0]
+
+def get_checkpoint(c, source):
+    c.execute("SELECT position FROM import_checkpoints WHERE source = ?", (source,))
+    row = c.fetchone()
+    return row['position'] if row else 0
+
+def set_checkpoint(c, source, position):
+    c.execute('''
+        INSERT INTO import_checkpoints (source, position, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET position = excluded.position, updated_at = excluded.updated_at
+    ''', (source, position, datetime.datetime.now().isoformat(timespec='seconds')))
+
+def get_imported_keys(c, source):
+    c.execute("SELECT key FROM import_seen WHERE source = ?", (source,))
+    return {row['key'] for row in c.fetchall()}
+
+def mark_imported(c, source, keys):
+    c.executemany("INSERT OR IGNORE INTO import_seen (source, key) VALUES (?, ?)", [(source, key) for key in keys])
+
+def _run(source, tasks, workers, initializer=None, initargs=(), checkpoint=set_checkpoint):
+    """
+    Parses task batches (fn, args) on a process pool and inserts the results
+    in submission order. Each batch returns (position, results); position
+    is saved with checkpoint(c, source, position) in the same commit as the
+    batch, so an interrupted import resumes after the last committed batch.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    router = shards.Router(conn)
+
+    new_count = 0
+    skip_count = 0
+    error_count = 0
+
+    def write(position, results):
+        nonlocal new_count, skip_count, error_count
+        for result in results:
+            if isinstance(result, str):
+                print(result)
+                error_count += 1
+            else:
+                try:
+                    target = router.cursor(result[1])
+                except RuntimeError as e:
+                    if router.in_frozen_shard(result[1], result[0], parser.content_hash(result[4])):
+                        skip_count += 1
+                    else:
+                        # new mail for a frozen shard; re-run with --restart after thawing it
+                        print(f"{result[0]}: {e}")
+                        error_count += 1
+                    continue
+                if parser.insert_email(target, *result):
+                    new_count += 1
+                else:
+                    skip_count += 1
+        checkpoint(c, source, position)
+        router.commit()
+        print(f"Imported {new_count} (skipped {skip_count}, errors {error_count})...")
+
+    if workers <= 1:
+        if initializer:
+            initializer(*initargs)
+        for fn, args in tasks:
+            write(*fn(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+            pending = deque()
+            for fn, args in tasks:
+                pending.append(pool.submit(fn, *args))
+                if len(pending) >= workers * PREFETCH_PER_WORKER:
+                    write(*pending.popleft().result())
+            while pending:
+                write(*pending.popleft().result())
+
+    router.close()
+    conn.close()
+
+    metrics.items("import", new_count)
+    metrics.cache_hit("import", skip_count)
+    metrics.error("import", error_count)
+
+    print("Import complete.")
+    print(f"Imported: {new_count}")
+    print(f"Skipped (Duplicate): {skip_count}")
+    print(f"Errors: {error_count}")
+
+def import_mbox(path, workers=None, restart=False):
+    """
+    Imports an mbox file (e.g. a Gmail Takeout export) into the emails table.
+    The file is memory-mapped and split on "From " lines; messages are parsed
+    in parallel through the same path as `parser.process_raw_files`.
+    """
+    path = os.path.abspath(path)
+    workers = workers or os.cpu_count() or 1
+
+    conn = get_db_connection()
+    start = 0 if restart else get_checkpoint(conn.cursor(), path)
+    conn.close()
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or start >= size:
+            print(f"Nothing to import from {path}.")
+            return
+        if start:
+            print(f"Resuming {path} at byte {start} of {size}.")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            tasks = ((_parse_mbox_batch, (path, batch)) for batch in _batched_spans(split_mbox(mm, start)))
+            _run(path, tasks, workers, _init_mbox_worker, (path,))
+        finally:
+            mm.close()
+
+def import_maildir(root, workers=None, restart=False):
+    """
+    Imports every message of a Maildir tree. The checkpoint is the set of
+    Maildir unique names already imported, so a resumed import is correct
+    even if the client moved or renamed files or new mail was delivered.
+    """
+    root = os.path.abspath(root)
+    workers = workers or os.cpu_count() or 1
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    if restart:
+        c.execute("DELETE FROM import_seen WHERE source = ?", (root,))
+        conn.commit()
+    imported = get_imported_keys(c, root)
+    conn.close()
+
+    all_paths = walk_maildir(root)
+    paths = [p for p in all_paths if maildir_key(p) not in imported]
+    if not paths:
+        print(f"Nothing to import from {root}.")
+        return
+    if imported:
+        print(f"Resuming {root}: {len(paths)} of {len(all_paths)} messages left.")
+
+    tasks = (
+        (_parse_maildir_batch, (root, paths[i:i + BATCH_MESSAGES]))
+        for i in range(0, len(paths), BATCH_MESSAGES)
+    )
+    _run(root, tasks, workers, checkpoint=mark_imported)
+
+@metrics.stage("import")
+def import_path(path, fmt="auto", workers=None, restart=False):
+    """
+    Imports an mbox file or a Maildir directory.
+    """
+    if not os.path.exists(path):
+        print(f"Path {path} does not exist.")
+        return
+    if fmt == "auto":
+        fmt = "maildir" if os.path.isdir(path) else "mbox"
+
+    if fmt == "maildir":
+        import_maildir(path, workers, restart)
+    else:
+        import_mbox(path, workers, restart)
@@ -5,6 +5,7 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from . import metrics
 
 # If modifying these scopes, we should delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
@@ -37,6 +38,7 @@ def authenticate_gmail():
 
     return build('gmail', 'v1', credentials=creds)
 
+@metrics.stage("ingest")
 def download_recent_emails(days=90):
     """Downloads raw emails from the last n days."""
     service = authenticate_gmail()
@@ -53,7 +55,8 @@ def download_recent_emails(days=90):
     next_page_token = None
     
     while True:
-        results = service.users().messages().list(userId='me', q=query, pageToken=next_page_token).execute()
+        with metrics.timed("gmail_request_seconds", op="list"):
+            results = service.users().messages().list(userId='me', q=query, pageToken=next_page_token).execute()
         batch_messages = results.get('messages', [])
         messages.extend(batch_messages)
         
@@ -71,18 +74,22 @@ def download_recent_emails(days=90):
         
         if os.path.exists(file_path):
             print(f"[{i+1}/{len(messages)}] Skipping {msg_id} (already exists)")
+            metrics.cache_hit("ingest")
             continue
 
         try:
             # We fetch 'raw' format to preserve the original email content perfectly for later parsing
             # The response will be a JSON object containing a 'raw' field (base64url encoded)
             # TODO: Consider using 'full' format if metadata is needed
-            message_full = service.users().messages().get(userId='me', id=msg_id, format='raw').execute()
+            with metrics.timed("gmail_request_seconds", op="get"):
+                message_full = service.users().messages().get(userId='me', id=msg_id, format='raw').execute()
             
             with open(file_path, 'w') as f:
                 json.dump(message_full, f)
             
             print(f"[{i+1}/{len(messages)}] Downloaded {msg_id}")
+            metrics.items("ingest")
         except Exception as e:
             print(f"Error downloading {msg_id}: {e}")
+            metrics.error("ingest")
 
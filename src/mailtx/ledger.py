@@ -1,17 +1,33 @@
 import sqlite3
 from .db import get_db_connection
 from . import extractor
+from . import metrics
+from . import shards
 
+# Marks a near-duplicate cluster whose representative was not a transaction.
+NOT_A_TX = object()
+
+@metrics.stage("ledger")
 def build_ledger(process_all=False):
     """
     Iterates through emails and populates the tx table.
+    With a sharded layout each writable shard is processed in turn; tx rows
+    are stored next to their email.
     
     Args:
         process_all (bool): If True, re-processes emails even if they are already in tx table.
                             (Note: This might cause unique constraint errors if not handled, 
                              so currently we just skip existing ones).
     """
+    for db_path, _ in shards.databases(writable=True):
+        _build_database_ledger(db_path)
+
     conn = get_db_connection()
+    shards.refresh_tx_dates(conn)
+    conn.close()
+
+def _build_database_ledger(db_path):
+    conn = get_db_connection(db_path)
     c = conn.cursor()
 
     # 1. Get candidates
@@ -24,7 +40,11 @@ def build_ledger(process_all=False):
     existing_tx_ids = {row['email_id'] for row in c.fetchall()}
     
     # get all emails
-    c.execute("SELECT id, subject, body_text, date FROM emails")
+    c.execute('''
+        SELECT e.id, e.subject, e.body_text, e.date, s.cluster_id
+        FROM emails e
+        LEFT JOIN email_minhash s ON s.email_id = e.id
+    ''')
     all_emails = c.fetchall()
     
     candidates = []
@@ -32,6 +52,7 @@ def build_ledger(process_all=False):
     
     for row in all_emails:
         if row['id'] in existing_tx_ids:
+            metrics.cache_hit("ledger")
             continue
             
         # Keyword filtering
@@ -40,9 +61,16 @@ def build_ledger(process_all=False):
             candidates.append(row)
             
     print(f"Found {len(candidates)} candidate emails (keyword filtered) out of {len(all_emails)} total.")
+
+    # cluster representatives first, so their near-duplicates can use them as templates
+    candidates.sort(key=lambda r: bool(r['cluster_id']) and r['cluster_id'] != r['id'])
     
     processed_count = 0
     tx_count = 0
+    template_count = 0
+
+    # cluster_id -> known transaction for the cluster, or NOT_A_TX
+    cluster_templates = {}
     
     for i, row in enumerate(candidates):
         email_id = row['id']
@@ -62,7 +90,40 @@ def build_ledger(process_all=False):
         print(f"Processing {i+1}/{len(candidates)}: {subject[:50]}...")
         
         # 2. extract data
-        tx_data = extractor.extract_tx_data(full_text)
+        # near-duplicates of an already-extracted email only re-check amount/date
+        cluster_id = row['cluster_id']
+        tx_data = None
+        if cluster_id and cluster_id not in cluster_templates:
+            c.execute('''
+                SELECT tx.merchant, tx.currency, tx.category FROM tx
+                JOIN email_minhash s ON s.email_id = tx.email_id
+                WHERE s.cluster_id = ?
+                LIMIT 1
+            ''', (cluster_id,))
+            hit = c.fetchone()
+            if hit:
+                cluster_templates[cluster_id] = hit
+        template = cluster_templates.get(cluster_id)
+
+        if template is NOT_A_TX:
+            print("  -> Skipped (near-duplicate of a non-transaction email)")
+            metrics.cache_hit("ledger")
+            continue
+        if template is not None:
+            tx_data = extractor.recheck_tx_data(template, f"{subject}\n{body[:2000]}", email_date)
+            if tx_data:
+                metrics.cache_hit("ledger")
+                template_count += 1
+
+        if tx_data is None:
+            try:
+                tx_data = extractor.extract_tx_data(full_text, raise_errors=True)
+            except Exception as e:
+                # a failed call says nothing about the cluster; don't cache it
+                print(f"  -> Extraction failed: {e}")
+            else:
+                if cluster_id:
+                    cluster_templates.setdefault(cluster_id, tx_data or NOT_A_TX)
         
         if tx_data:
             # 3. insert into tx table
@@ -85,12 +146,16 @@ def build_ledger(process_all=False):
                 tx_count += 1
             except sqlite3.IntegrityError as e:
                 print(f"  -> Error inserting tx: {e}")
+                metrics.error("ledger")
         else:
             # print("  -> No transaction found.")
             pass
             
         processed_count += 1
+        metrics.items("ledger")
 
     conn.close()
     print(f"Ledger build complete. Processed {processed_count} emails. Added {tx_count} transactions.")
+    if template_count:
+        print(f"{template_count} transactions were filled in from near-duplicate templates.")
 
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "mailtx"
+
+# Seconds. Covers fast local calls up to slow first-token model loads.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def inc(name, value=1, **labels):
+    """Adds `value` to the counter `name` with the given labels."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Records one observation in the histogram `name`."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+                break
+        hist["sum"] += value
+        hist["count"] += 1
+
+@contextmanager
+def timed(name, **labels):
+    """Times the enclosed block into the histogram `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+@contextmanager
+def stage(name):
+    """
+    Accumulates wall time for a pipeline stage. Pair with `items(name, n)`
+    and `error(name)` so a run reports items/sec and error counts per stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        inc("stage_seconds_total", time.perf_counter() - start, stage=name)
+        inc("stage_runs_total", stage=name)
+
+def items(stage_name, n=1):
+    inc("stage_items_total", n, stage=stage_name)
+
+def error(stage_name, n=1):
+    inc("stage_errors_total", n, stage=stage_name)
+
+def cache_hit(stage_name, n=1):
+    inc("cache_hits_total", n, stage=stage_name)
+
+def _response_value(response, key):
+    try:
+        return response.get(key)
+    except AttributeError:
+        return None
+
+def ollama_call(fn, op, model, **kwargs):
+    """
+    Calls `fn(model=model, **kwargs)` (an `ollama` API function) and records
+    request latency plus the prompt/eval token counts reported in the response.
+    """
+    start = time.perf_counter()
+    try:
+        response = fn(model=model, **kwargs)
+    except Exception:
+        inc("ollama_errors_total", op=op, model=model)
+        raise
+    finally:
+        observe("ollama_request_seconds", time.perf_counter() - start, op=op, model=model)
+
+    for field in ("prompt_eval_count", "eval_count"):
+        count = _response_value(response, field)
+        if count:
+            inc(f"ollama_{field}_total", count, op=op, model=model)
+    return response
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def snapshot():
+    """
+    Returns all metrics as a JSON-serializable dict, with per-stage
+    seconds, items, items/sec, errors and cache hits rolled up.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: dict(v, counts=list(v["counts"])) for k, v in _histograms.items()}
+
+    stages = {}
+    fields = {
+        "stage_seconds_total": "seconds",
+        "stage_runs_total": "runs",
+        "stage_items_total": "items",
+        "stage_errors_total": "errors",
+        "cache_hits_total": "cache_hits",
+    }
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name in fields and "stage" in labels:
+            stages.setdefault(labels["stage"], {})[fields[name]] = value
+    for data in stages.values():
+        seconds = data.get("seconds")
+        if seconds and "items" in data:
+            data["items_per_sec"] = data["items"] / seconds
+
+    return {
+        "stages": stages,
+        "counters": [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(counters.items())
+        ],
+        "histograms": [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "buckets": dict(zip((str(b) for b in hist["buckets"]), hist["counts"])),
+                "sum": hist["sum"],
+                "count": hist["count"],
+            }
+            for (name, labels), hist in sorted(histograms.items())
+        ],
+    }
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def to_prometheus():
+    """Renders all metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, dict(v, counts=list(v["counts"]))) for k, v in _histograms.items())
+
+    lines = []
+    seen = set()
+    for (name, labels), value in counters:
+        full = f"{PREFIX}_{name}"
+        if full not in seen:
+            lines.append(f"# TYPE {full} counter")
+            seen.add(full)
+        lines.append(f"{full}{_format_labels(labels)} {value}")
+
+    for (name, labels), hist in histograms:
+        full = f"{PREFIX}_{name}"
+        if full not in seen:
+            lines.append(f"# TYPE {full} histogram")
+            seen.add(full)
+        cumulative = 0
+        for bound, count in zip(hist["buckets"], hist["counts"]):
+            cumulative += count
+            lines.append(f"{full}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{full}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{full}_count{_format_labels(labels)} {hist['count']}")
+
+    return "\n".join(lines) + "\n"
+
+def write_json(path):
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+
+def write_prometheus(path):
+    # Write-then-rename so a textfile collector never reads a partial file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(to_prometheus())
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port, host="127.0.0.1"):
+    """
+    Serves /metrics on a background thread for the lifetime of the process.
+    Returns the server so callers can shut it down.
+    """
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,135 @@
+import re
+import hashlib
+from email.utils import parseaddr
+import numpy as np
+
+# MinHash over word bigrams, with LSH banding: NUM_PERM minimum hashes split
+# into BANDS bands of ROWS values. Each band is hashed, together with the
+# sender, into a bucket; emails that share a bucket are candidates, and a
+# candidate joins the cluster when its estimated Jaccard similarity is at
+# least JACCARD_THRESHOLD. With 16 bands of 4 rows, a pair at similarity
+# 0.75 shares a bucket with probability > 0.99.
+#
+# Receipts are short (30-60 words), so one changed first name or currency
+# code already drops the bigram Jaccard similarity of two copies of the same
+# template to about 0.8. Copies of one template with a different merchant
+# score the same, so only mail from the same sender is clustered.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+JACCARD_THRESHOLD = 0.6
+
+SHINGLE_SIZE = 2
+
+# Only cluster representatives are stored in buckets; cap the candidates
+# compared per email all the same.
+BAND_PROBE_LIMIT = 64
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Fixed seed: signatures must be comparable across runs and databases.
+_perm_rng = np.random.default_rng(1)
+_PERM_A = _perm_rng.integers(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _perm_rng.integers(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+_DIGITS_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+")
+
+def normalize(text):
+    """
+    Lowercases and masks digit runs so that emails differing only in
+    amounts, dates, order or tracking numbers normalize to the same text.
+    """
+    return _DIGITS_RE.sub("0", (text or "").lower())
+
+def shingles(text):
+    words = _WORD_RE.findall(normalize(text))
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash(text):
+    """MinHash signature (NUM_PERM uint32 values) of the normalized text's word shingles."""
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "big")
+         for s in shingles(text)],
+        dtype=np.uint64,
+    )
+    if not len(hashes):
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    # (a * x + b) mod p for every shingle and permutation; a, b and x are
+    # below 2**32, so the product cannot overflow 64 bits.
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % np.uint64(_MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+def sender_key(from_addr):
+    return parseaddr(from_addr or "")[1].lower()
+
+def buckets(signature, sender):
+    """One signed 64-bit bucket id per band, scoped to the sender."""
+    result = []
+    for i in range(BANDS):
+        band = signature[i * ROWS:(i + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(f"{i}:{sender}\0".encode("utf-8") + band, digest_size=8).digest()
+        result.append(int.from_bytes(digest, "big", signed=True))
+    return result
+
+def signature_text(subject, body_text):
+    return f"{subject or ''}\n{body_text or ''}"
+
+def index_email(c, email_id, from_addr, subject, body_text, signature=None):
+    """
+    Computes the email's MinHash (unless given as `signature`), joins it to
+    the most similar cluster representative from the same sender at or
+    above JACCARD_THRESHOLD, or starts a new cluster, and stores it.
+    Returns the cluster id, which is the id of the cluster's first email.
+    """
+    if signature is None:
+        signature = minhash(signature_text(subject, body_text))
+    bucket_ids = buckets(signature, sender_key(from_addr))
+
+    c.execute(f'''
+        SELECT m.signature, m.cluster_id FROM email_minhash m
+        WHERE m.email_id IN (
+            SELECT email_id FROM minhash_buckets WHERE bucket IN ({", ".join("?" * BANDS)})
+        )
+        LIMIT ?
+    ''', bucket_ids + [BAND_PROBE_LIMIT])
+
+    cluster_id = email_id
+    best = JACCARD_THRESHOLD
+    for row in c.fetchall():
+        score = similarity(signature, np.frombuffer(row['signature'], dtype=np.uint32))
+        if score >= best:
+            best = score
+            cluster_id = row['cluster_id']
+
+    c.execute('''
+        INSERT OR REPLACE INTO email_minhash (email_id, signature, cluster_id)
+        VALUES (?, ?, ?)
+    ''', (email_id, signature.tobytes(), cluster_id))
+    if cluster_id == email_id:
+        c.executemany("INSERT OR IGNORE INTO minhash_buckets (bucket, email_id) VALUES (?, ?)",
+                      [(bucket, email_id) for bucket in bucket_ids])
+    return cluster_id
+
+def index_missing(c):
+    """
+    Indexes emails that have no signature yet (e.g. imported before
+    near-duplicate detection existed, or before it switched to MinHash).
+    Returns the number indexed.
+    """
+    c.execute('''
+        SELECT e.id, e.from_addr, e.subject, e.body_text
+        FROM emails e
+        LEFT JOIN email_minhash m ON m.email_id = e.id
+        WHERE m.email_id IS NULL
+    ''')
+    rows = c.fetchall()
+    for row in rows:
+        index_email(c, row['id'], row['from_addr'], row['subject'], row['body_text'])
+    return len(rows)
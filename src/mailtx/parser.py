@@ -8,6 +8,9 @@ from email import policy
 from bs4 import BeautifulSoup
 from dateutil import parser as date_parser
 from .db import get_db_connection
+from . import metrics
+from . import neardup
+from . import shards
 
 RAW_DATA_DIR = "data/raw"
 
@@ -71,6 +74,67 @@ def get_email_body(payload):
 
     return ""
 
+def parse_mime_bytes(raw_bytes):
+    """
+    Parses an RFC 822 message.
+    Returns (subject, from_addr, date_str, body_text).
+    """
+    msg = email.message_from_bytes(raw_bytes, policy=policy.default)
+
+    subject = msg['subject'] or "(No Subject)"
+    from_addr = msg['from'] or "(Unknown)"
+    date_str = msg['date']
+
+    # Extract body using email library's logic
+    body_text = ""
+    body_part = msg.get_body(preferencelist=('plain', 'html'))
+
+    if body_part:
+        try:
+            content = body_part.get_content()
+            if body_part.get_content_type() == 'text/html':
+                body_text = extract_text_from_html(content)
+            else:
+                body_text = content
+        except Exception:
+            # Fallback if get_content fails (e.g. encoding issues)
+            body_text = str(body_part.get_payload(decode=True), errors='replace')
+
+    return subject, from_addr, date_str, body_text
+
+def parse_date(date_str):
+    """Normalizes a Date header to YYYY-MM-DD, or None."""
+    try:
+        if date_str:
+            dt = date_parser.parse(date_str)
+            return dt.strftime('%Y-%m-%d')
+    except Exception:
+        pass
+    return None
+
+def content_hash(body_text):
+    return hashlib.sha256(body_text.encode('utf-8')).hexdigest()
+
+def insert_email(c, email_id, iso_date, from_addr, subject, body_text, raw_path, signature=None):
+    """
+    Inserts a parsed email and indexes it for near-duplicate detection.
+    `signature` is the email's MinHash if already computed.
+    Returns False if it was a duplicate (same id or content_hash).
+    """
+    body_hash = content_hash(body_text)
+    # stored compressed if the database has a body codec configured
+    stored_body = c.connection.encode_body(body_text)
+    try:
+        c.execute('''
+            INSERT INTO emails (id, date, from_addr, subject, body_text, raw_path, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (email_id, iso_date, from_addr, subject, stored_body, raw_path, body_hash))
+    except sqlite3.IntegrityError:
+        return False
+    neardup.index_email(c, email_id, from_addr, subject, body_text, signature)
+    return True
+
+@metrics.stage("parse")
 def process_raw_files(folder_path=RAW_DATA_DIR):
     """
     Iterates through raw JSON files, parses them, and inserts into SQLite.
@@ -81,6 +145,8 @@ def process_raw_files(folder_path=RAW_DATA_DIR):
 
     conn = get_db_connection()
     c = conn.cursor()
+    # emails go to the shard for their date when the layout is sharded
+    router = shards.Router(conn)
     
     files = [f for f in os.listdir(folder_path) if f.endswith('.json')]
     print(f"Found {len(files)} files to process.")
@@ -89,6 +155,11 @@ def process_raw_files(folder_path=RAW_DATA_DIR):
     skip_count = 0
     error_count = 0
 
+    # emails imported before near-duplicate detection existed
+    backfilled = neardup.index_missing(c)
+    if backfilled:
+        print(f"Indexed {backfilled} existing emails for near-duplicate detection.")
+
     for filename in files:
         file_path = os.path.join(folder_path, filename)
         
@@ -109,26 +180,7 @@ def process_raw_files(folder_path=RAW_DATA_DIR):
                     raw_bytes = base64.urlsafe_b64decode(raw_base64)
                     
                     # Parse MIME message
-                    msg = email.message_from_bytes(raw_bytes, policy=policy.default)
-                    
-                    subject = msg['subject'] or "(No Subject)"
-                    from_addr = msg['from'] or "(Unknown)"
-                    date_str = msg['date']
-                    
-                    # Extract body using email library's logic
-                    body_text = ""
-                    body_part = msg.get_body(preferencelist=('plain', 'html'))
-                    
-                    if body_part:
-                        try:
-                            content = body_part.get_content()
-                            if body_part.get_content_type() == 'text/html':
-                                body_text = extract_text_from_html(content)
-                            else:
-                                body_text = content
-                        except Exception:
-                            # Fallback if get_content fails (e.g. encoding issues)
-                            body_text = str(body_part.get_payload(decode=True), errors='replace')
+                    subject, from_addr, date_str, body_text = parse_mime_bytes(raw_bytes)
                             
                 except Exception as e:
                     print(f"Error parsing MIME for {filename}: {e}")
@@ -154,26 +206,21 @@ def process_raw_files(folder_path=RAW_DATA_DIR):
                         body_text = decode_body(data)
 
             # Parse Date
+            iso_date = parse_date(date_str)
+
             try:
-                if date_str:
-                    dt = date_parser.parse(date_str)
-                    iso_date = dt.strftime('%Y-%m-%d')
-                else:
-                    iso_date = None
-            except Exception:
-                iso_date = None
-
-            # Generate Content Hash
-            content_hash = hashlib.sha256(body_text.encode('utf-8')).hexdigest()
-            
+                target = router.cursor(iso_date)
+            except RuntimeError:
+                # frozen shard: mail already in it is a duplicate, new mail an error
+                if not router.in_frozen_shard(iso_date, email_id, content_hash(body_text)):
+                    raise
+                skip_count += 1
+                continue
+
             # Insert into DB
-            try:
-                c.execute('''
-                    INSERT INTO emails (id, date, from_addr, subject, body_text, raw_path, content_hash)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (email_id, iso_date, from_addr, subject, body_text, file_path, content_hash))
+            if insert_email(target, email_id, iso_date, from_addr, subject, body_text, file_path):
                 new_count += 1
-            except sqlite3.IntegrityError:
+            else:
                 # Likely duplicate content_hash or id
                 skip_count += 1
                 
@@ -181,8 +228,14 @@ def process_raw_files(folder_path=RAW_DATA_DIR):
             print(f"Error processing {filename}: {e}")
             error_count += 1
 
-    conn.commit()
+    router.commit()
+    router.close()
     conn.close()
+
+    metrics.items("parse", new_count)
+    # content_hash duplicates are work we avoided, so count them as cache hits
+    metrics.cache_hit("parse", skip_count)
+    metrics.error("parse", error_count)
     
     print(f"Processing complete.")
     print(f"Imported: {new_count}")
@@ -2,7 +2,8 @@ import sqlite3
 import json
 import datetime
 import ollama
-from .db import get_db_connection
+from . import metrics
+from . import shards
 
 MODEL_NAME = "llama3.2"
 
@@ -31,8 +32,8 @@ def parse_intent(user_query):
     prompt = SYSTEM_PROMPT.format(current_date=today)
     
     try:
-        response = ollama.chat(
-            model=MODEL_NAME,
+        response = metrics.ollama_call(
+            ollama.chat, "parse_intent", MODEL_NAME,
             messages=[
                 {'role': 'system', 'content': prompt},
                 {'role': 'user', 'content': user_query},
@@ -52,15 +53,15 @@ def parse_intent(user_query):
         print(f"Error parsing intent: {e}")
         return None
 
+@metrics.stage("query")
 def execute_query(params):
     """
     Constructs and executes a SQL query based on the extracted parameters.
+    With a sharded layout the query runs in parallel on the shards that can
+    hold the date range, and the results are merged.
     """
     if not params:
         return None
-        
-    conn = get_db_connection()
-    c = conn.cursor()
     
     query_parts = ["SELECT"]
     args = []
@@ -93,17 +94,37 @@ def execute_query(params):
         query_parts.append("ORDER BY tx_date DESC")
         
     sql = " ".join(query_parts)
+    targets = shards.databases(params.get('start_date'), params.get('end_date'), for_tx=True)
     
     try:
-        c.execute(sql, args)
-        rows = c.fetchall()
-        conn.close()
-        return rows
+        results = shards.fan_out(lambda c: c.execute(sql, args).fetchall(), targets)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        conn.close()
+        metrics.error("query")
         return None
 
+    rows = merge_results(results, params)
+    metrics.items("query", len(rows))
+    return rows
+
+def merge_results(results, params):
+    """
+    Combines per-shard rows: sums are added up per currency, lists are
+    merged newest first.
+    """
+    if len(results) == 1:
+        return results[0]
+    if params.get('metric') == 'sum':
+        totals = {}
+        for rows in results:
+            for row in rows:
+                if row['total'] is not None:
+                    totals[row['currency']] = totals.get(row['currency'], 0) + row['total']
+        return [{'total': total, 'currency': currency} for currency, total in totals.items()]
+    rows = [row for shard_rows in results for row in shard_rows]
+    rows.sort(key=lambda row: (row['tx_date'] is not None, row['tx_date'] or ""), reverse=True)
+    return rows
+
 def format_result(rows, params):
     """
     Formats the query result for display.
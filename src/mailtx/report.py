@@ -0,0 +1,176 @@
+import io
+import os
+import csv
+import json
+import datetime
+import numpy as np
+from .db import get_setting, DB_PATH
+from . import metrics
+from . import shards
+
+DIMENSIONS = ("category", "merchant", "week", "month", "currency")
+
+# Days since 1970-01-01 for transactions without a parseable date.
+NO_DATE = np.iinfo(np.int32).min
+
+def cache_path():
+    return f"{DB_PATH}.tx.npz"
+
+def _encode(values):
+    """Dictionary-encodes strings: returns (codes int32, labels array)."""
+    labels, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return codes.astype(np.int32), labels
+
+def _date_days(tx_dates):
+    days = np.full(len(tx_dates), NO_DATE, dtype=np.int32)
+    for i, value in enumerate(tx_dates):
+        try:
+            days[i] = (datetime.date.fromisoformat(value[:10]) - datetime.date(1970, 1, 1)).days
+        except (TypeError, ValueError):
+            continue
+    return days
+
+def _tx_rows(c):
+    return c.execute("SELECT merchant, category, currency, tx_date, amount_cents FROM tx").fetchall()
+
+def build_snapshot(rows):
+    """Packs tx rows into NumPy columns."""
+    merchant, merchants = _encode([(r['merchant'] or "Unknown").strip() for r in rows])
+    category, categories = _encode([r['category'] or "Other" for r in rows])
+    currency, currencies = _encode([(r['currency'] or "USD").upper() for r in rows])
+    return {
+        'date_days': _date_days([r['tx_date'] for r in rows]),
+        'merchant': merchant,
+        'category': category,
+        'currency': currency,
+        'cents': np.array([r['amount_cents'] or 0 for r in rows], dtype=np.int64),
+        'merchant_labels': merchants,
+        'category_labels': categories,
+        'currency_labels': currencies,
+    }
+
+def load_snapshot():
+    """
+    Returns the columnar tx snapshot, from the on-disk cache when the
+    tx_version of every database (bumped by triggers on each tx change)
+    matches the cached one, otherwise rebuilt from SQLite and re-cached.
+    With a sharded layout the snapshot covers all shards.
+    """
+    targets = shards.databases()
+    versions = shards.fan_out(lambda c: get_setting(c, 'tx_version', 0), targets)
+    state = ";".join(f"{target}={version}" for (target, _), version in zip(targets, versions))
+    path = cache_path()
+
+    if os.path.exists(path):
+        try:
+            with np.load(path) as cached:
+                if str(cached['tx_state']) == state:
+                    metrics.cache_hit("report")
+                    return {k: cached[k] for k in cached.files if k != 'tx_state'}
+        except (OSError, KeyError, ValueError):
+            pass  # unreadable cache; rebuild it
+
+    rows = [row for shard_rows in shards.fan_out(_tx_rows, targets) for row in shard_rows]
+    snapshot = build_snapshot(rows)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, tx_state=np.array(state), **snapshot)
+    os.replace(tmp_path, path)
+    return snapshot
+
+def _days(date_str):
+    return (datetime.date.fromisoformat(date_str) - datetime.date(1970, 1, 1)).days
+
+def _group_keys(snapshot, dim, mask):
+    """Per-row group codes and a function mapping a code to its label."""
+    days = snapshot['date_days'][mask]
+    if dim in ("category", "merchant", "currency"):
+        labels = snapshot[f'{dim}_labels']
+        return snapshot[dim][mask].astype(np.int64), lambda code: str(labels[code])
+    if dim == "month":
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return months, lambda code: str(np.datetime64(code, 'M'))
+    if dim == "week":
+        # 1970-01-01 was a Thursday; weeks start on Monday
+        weeks = (days.astype(np.int64) - 4) // 7
+        return weeks, lambda code: str(np.datetime64(int(code) * 7 + 4, 'D'))
+    raise ValueError(f"Unknown dimension: {dim}")
+
+def aggregate(snapshot, dims=DIMENSIONS, start_date=None, end_date=None):
+    """
+    Computes sum/count/average of amounts for each dimension in `dims`,
+    always split by currency so totals never mix currencies.
+    The date filter is applied once and shared by every breakdown.
+    """
+    days = snapshot['date_days']
+    mask = np.ones(days.shape[0], dtype=bool)
+    if start_date:
+        mask &= days >= _days(start_date)
+    if end_date:
+        mask &= (days <= _days(end_date)) & (days != NO_DATE)
+    dated = days[mask] != NO_DATE
+    cents = snapshot['cents'][mask]
+    currency = snapshot['currency'][mask].astype(np.int64)
+    currency_labels = snapshot['currency_labels']
+
+    results = {}
+    for dim in dims:
+        keys, label = _group_keys(snapshot, dim, mask)
+        sel = dated if dim in ("week", "month") else slice(None)
+        keys, cur, amounts = keys[sel], currency[sel], cents[sel]
+        if keys.size == 0:
+            results[dim] = []
+            continue
+
+        # one composite key per (group, currency), then a single bincount
+        key_min = keys.min()
+        n_cur = len(currency_labels)
+        composite = (keys - key_min) * n_cur + cur
+        uniq, inverse = np.unique(composite, return_inverse=True)
+        totals = np.bincount(inverse, weights=amounts, minlength=len(uniq))
+        counts = np.bincount(inverse, minlength=len(uniq))
+
+        rows = []
+        for u, total, count in zip(uniq, totals, counts):
+            group = int(u // n_cur + key_min)
+            rows.append({
+                dim: label(group),
+                'currency': str(currency_labels[int(u % n_cur)]),
+                'total': round(float(total) / 100.0, 2),
+                'count': int(count),
+                'average': round(float(total) / count / 100.0, 2),
+            })
+        if dim in ("week", "month"):
+            rows.sort(key=lambda r: (r['currency'], r[dim]))
+        else:
+            rows.sort(key=lambda r: (r['currency'], -r['total']))
+        results[dim] = rows
+    return results
+
+def to_csv(breakdowns):
+    """Long format: one line per (breakdown, group, currency)."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["breakdown", "group", "currency", "total", "count", "average"])
+    for dim, rows in breakdowns.items():
+        for r in rows:
+            writer.writerow([dim, r[dim], r['currency'], f"{r['total']:.2f}", r['count'], f"{r['average']:.2f}"])
+    return out.getvalue()
+
+@metrics.stage("report")
+def generate_report(dims=DIMENSIONS, start_date=None, end_date=None, fmt="json"):
+    """
+    Builds a multi-breakdown spending report from the columnar snapshot.
+    Returns the report as a JSON or CSV string.
+    """
+    snapshot = load_snapshot()
+    metrics.items("report", len(snapshot['cents']))
+    breakdowns = aggregate(snapshot, dims, start_date, end_date)
+    if fmt == "csv":
+        return to_csv(breakdowns)
+    return json.dumps({
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'start_date': start_date,
+        'end_date': end_date,
+        'transactions': int(len(snapshot['cents'])),
+        'breakdowns': breakdowns,
+    }, indent=2)
@@ -0,0 +1,204 @@
+import re
+import sqlite3
+import numpy as np
+from . import embed
+from . import shards
+from . import vectors
+from . import metrics
+
+# How many BM25 hits survive the keyword stage and get vector-scored.
+CANDIDATE_LIMIT = 200
+
+# Reciprocal rank fusion constant. 60 is the value from the original RRF paper
+# and keeps a single top rank in one list from dominating the fused order.
+RRF_K = 60
+
+# SQLite's default limit on host parameters is 999 on older builds.
+_PARAM_CHUNK = 900
+
+def build_fts_query(query_text):
+    """
+    Turns free text into an FTS5 MATCH expression.
+    Each whitespace-separated term becomes a quoted phrase, so tokens like
+    order numbers ("112-3456789") match as a unit, and terms are OR-ed so
+    BM25 decides the ranking.
+    """
+    terms = []
+    for raw in query_text.split():
+        term = raw.strip(".,;:!?()[]{}'\"")
+        if not re.search(r"\w", term):
+            continue
+        terms.append('"' + term.replace('"', '""') + '"')
+    return " OR ".join(terms)
+
+def _filter_clause(start_date, end_date, sender):
+    clauses = []
+    args = []
+    if start_date:
+        clauses.append("AND e.date >= ?")
+        args.append(start_date)
+    if end_date:
+        clauses.append("AND e.date <= ?")
+        args.append(end_date)
+    if sender:
+        clauses.append("AND e.from_addr LIKE ?")
+        args.append(f"%{sender}%")
+    return " ".join(clauses), args
+
+def keyword_candidates(c, query_text, start_date=None, end_date=None, sender=None, limit=CANDIDATE_LIMIT,
+                       with_scores=False):
+    """
+    Returns email ids matching `query_text` in emails_fts, best BM25 first.
+    Subject matches weigh double the body. `with_scores` returns
+    (email_id, bm25) pairs instead; lower bm25 is better.
+    """
+    fts_query = build_fts_query(query_text)
+    if not fts_query:
+        return []
+
+    filters, args = _filter_clause(start_date, end_date, sender)
+    try:
+        c.execute(f'''
+            SELECT e.id, bm25(emails_fts, 2.0, 1.0) AS score
+            FROM emails_fts
+            JOIN emails e ON e.rowid = emails_fts.rowid
+            WHERE emails_fts MATCH ? {filters}
+            ORDER BY score
+            LIMIT ?
+        ''', [fts_query] + args + [limit])
+    except sqlite3.OperationalError as e:
+        # FTS5 missing or an unparsable query; fall back to vector-only.
+        print(f"Keyword search unavailable: {e}")
+        return []
+    if with_scores:
+        return [(row['id'], row['score']) for row in c.fetchall()]
+    return [row['id'] for row in c.fetchall()]
+
+def filtered_ids(c, start_date=None, end_date=None, sender=None):
+    """All email ids passing the date/sender filters."""
+    filters, args = _filter_clause(start_date, end_date, sender)
+    c.execute(f"SELECT e.id FROM emails e WHERE 1=1 {filters}", args)
+    return [row['id'] for row in c.fetchall()]
+
+def vector_ranking(c, query_vector, email_ids):
+    """
+    Scores only the given emails' vectors against `query_vector`.
+    Returns [(email_id, similarity)] sorted best first.
+    """
+    ids = []
+    found = []
+    for i in range(0, len(email_ids), _PARAM_CHUNK):
+        chunk = email_ids[i:i + _PARAM_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT email_id, vector FROM embeddings WHERE email_id IN ({placeholders})", chunk)
+        for row in c.fetchall():
+            try:
+                found.append(vectors.decode_vector(row['vector']))
+                ids.append(row['email_id'])
+            except Exception as e:
+                print(f"Error processing vector for {row['email_id']}: {e}")
+                metrics.error("search")
+
+    if not ids:
+        return []
+    scores = embed.cosine_similarities(query_vector, np.vstack(found))
+    order = np.argsort(-scores)
+    return [(ids[i], float(scores[i])) for i in order]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several ranked lists of email ids: score = sum(1 / (k + rank)).
+    Returns [(email_id, score)] sorted best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, email_id in enumerate(ranking, start=1):
+            fused[email_id] = fused.get(email_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+def email_meta(c, email_ids):
+    """{email_id: row} with date, from_addr and subject for the given ids."""
+    placeholders = ",".join("?" * len(email_ids))
+    c.execute(f"SELECT id, date, from_addr, subject FROM emails WHERE id IN ({placeholders})", email_ids)
+    return {row['id']: row for row in c.fetchall()}
+
+@metrics.stage("search")
+def search(query_text, top_k=10, start_date=None, end_date=None, sender=None, candidate_limit=CANDIDATE_LIMIT):
+    """
+    Hybrid keyword + semantic search.
+
+    emails_fts narrows the mailbox to the best `candidate_limit` BM25 hits
+    (after date/sender filters); only those candidates' vectors are scored,
+    and the two rankings are merged with reciprocal rank fusion. If no email
+    matches the keywords, the filtered set is vector-scored instead.
+
+    With a sharded layout each stage runs in parallel on the shards covering
+    the date range. BM25 scores are merged across shards as they are: each
+    shard scores with its own term statistics, which is close enough for
+    picking candidates.
+
+    Returns a list of dicts with id, date, from_addr, subject and score.
+    """
+    targets = shards.databases(start_date, end_date)
+
+    keyword_hits = []
+    per_shard = shards.fan_out(lambda c: keyword_candidates(c, query_text, start_date, end_date, sender,
+                                                            candidate_limit, with_scores=True), targets)
+    for t, hits in enumerate(per_shard):
+        keyword_hits.extend((score, email_id, t) for email_id, score in hits)
+    keyword_hits.sort(key=lambda hit: hit[0])
+    keyword_hits = keyword_hits[:candidate_limit]
+    keyword_ranking = [email_id for _, email_id, _ in keyword_hits]
+
+    if keyword_hits:
+        candidates = [[] for _ in targets]
+        for _, email_id, t in keyword_hits:
+            candidates[t].append(email_id)
+    else:
+        candidates = shards.fan_out(lambda c: filtered_ids(c, start_date, end_date, sender), targets)
+    metrics.items("search", sum(len(ids) for ids in candidates))
+
+    semantic_ranking = []
+    if any(candidates):
+        try:
+            query_vector = embed.embed_text(query_text)
+            scored = shards.fan_out(lambda c, ids: vector_ranking(c, query_vector, ids), targets,
+                                    [(ids,) for ids in candidates])
+            hits = sorted((hit for shard_hits in scored for hit in shard_hits), key=lambda x: x[1], reverse=True)
+            semantic_ranking = [email_id for email_id, _ in hits]
+        except Exception as e:
+            print(f"Error generating query embedding: {e}")
+            metrics.error("search")
+
+    fused = reciprocal_rank_fusion([r for r in (keyword_ranking, semantic_ranking) if r])[:top_k]
+
+    results = []
+    if fused:
+        fused_ids = [email_id for email_id, _ in fused]
+        meta = {}
+        for shard_meta in shards.fan_out(lambda c: email_meta(c, fused_ids), targets):
+            meta.update(shard_meta)
+        for email_id, score in fused:
+            row = meta.get(email_id)
+            if row is None:
+                continue
+            results.append({
+                'id': email_id,
+                'date': row['date'],
+                'from_addr': row['from_addr'],
+                'subject': row['subject'],
+                'score': score,
+            })
+
+    return results
+
+def format_results(results):
+    """
+    Formats search results for display.
+    """
+    if not results:
+        return "No matching emails found."
+    output = [f"Top {len(results)} matches:"]
+    for r in results:
+        output.append(f"- [{r['date']}] {r['from_addr']}: {r['subject']} ({r['score']:.4f})")
+    return "\n".join(output)
@@ -0,0 +1,368 @@
+import os
+import stat
+import sqlite3
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from .db import get_db_connection, get_setting, set_setting, init_db, DB_PATH
+from . import metrics
+
+# Layouts: everything in mailtx.db, or emails/embeddings/tx split into one
+# SQLite file per year or quarter. mailtx.db keeps settings, import
+# checkpoints and the shard catalog.
+LAYOUTS = ("none", "year", "quarter")
+
+SHARD_DIR = "mailtx_shards"
+
+# Period for emails without a parseable date.
+UNDATED = "undated"
+
+# Threads used to query shards in parallel. SQLite and NumPy release the GIL
+# while they work, so threads are enough.
+MAX_WORKERS = 8
+
+# Body compression settings copied into new shards.
+_BODY_SETTINGS = ('body_codec', 'body_level', 'body_dict_id')
+
+def get_layout(conn):
+    return get_setting(conn, 'shard_layout', 'none')
+
+def period_for(iso_date, layout):
+    """Shard period ('2024', '2024Q3' or 'undated') for a YYYY-MM-DD date."""
+    try:
+        date = datetime.date.fromisoformat((iso_date or "")[:10])
+    except ValueError:
+        return UNDATED
+    if layout == "quarter":
+        return f"{date.year}Q{(date.month - 1) // 3 + 1}"
+    return str(date.year)
+
+def period_bounds(period):
+    """First and last date of a period, or (None, None) for undated."""
+    if period == UNDATED:
+        return None, None
+    if "Q" in period:
+        year, quarter = period.split("Q")
+        start = datetime.date(int(year), (int(quarter) - 1) * 3 + 1, 1)
+        end = datetime.date(int(year) + (quarter == "4"), (int(quarter) * 3) % 12 + 1, 1)
+    else:
+        start = datetime.date(int(period), 1, 1)
+        end = datetime.date(int(period) + 1, 1, 1)
+    return start.isoformat(), (end - datetime.timedelta(days=1)).isoformat()
+
+def shard_path(period):
+    return os.path.join(SHARD_DIR, f"mailtx-{period}.db")
+
+def databases(start_date=None, end_date=None, for_tx=False, writable=False):
+    """
+    [(path, read_only)] of the databases holding emails, embeddings and tx
+    for the date range: just mailtx.db when unsharded, otherwise the shards
+    whose period overlaps it. The undated shard is only included when no
+    range is given. `for_tx` filters on tx_date rather than the email date,
+    using the tx_date range recorded in the catalog; shards without one
+    (no dated tx, or not recorded yet) are always kept. `writable` leaves
+    out frozen shards.
+    """
+    conn = get_db_connection()
+    try:
+        if get_layout(conn) == "none":
+            return [(DB_PATH, False)]
+        rows = conn.execute("SELECT * FROM shards ORDER BY period").fetchall()
+    finally:
+        conn.close()
+
+    selected = []
+    for row in rows:
+        if writable and row['read_only']:
+            continue
+        if for_tx:
+            low, high = row['tx_start_date'], row['tx_end_date']
+            if low is not None and ((start_date and high < start_date) or (end_date and low > end_date)):
+                continue
+        elif row['period'] == UNDATED:
+            if start_date or end_date:
+                continue
+        elif (start_date and row['end_date'] < start_date) or (end_date and row['start_date'] > end_date):
+            continue
+        selected.append((row['path'], bool(row['read_only'])))
+    return selected
+
+def refresh_tx_dates(conn):
+    """
+    Records the tx_date range of every writable shard in the catalog, for
+    databases(for_tx=True). Run after tx rows are written or moved.
+    """
+    for row in conn.execute("SELECT period, path FROM shards WHERE read_only = 0").fetchall():
+        shard = connect(row['path'])
+        low, high = shard.execute("SELECT MIN(tx_date), MAX(tx_date) FROM tx").fetchone()
+        shard.close()
+        conn.execute("UPDATE shards SET tx_start_date = ?, tx_end_date = ? WHERE period = ?",
+                     (low, high, row['period']))
+    conn.commit()
+
+def connect(path, read_only=False):
+    return get_db_connection(path, read_only=read_only)
+
+def fan_out(fn, targets, args=None):
+    """
+    Calls fn(cursor, *args[i]) on a connection to each (path, read_only)
+    target, in parallel when there is more than one. Each call gets its own
+    connection. Returns the results in target order.
+    """
+    args = args or [()] * len(targets)
+
+    def run(target, target_args):
+        conn = connect(*target)
+        try:
+            return fn(conn.cursor(), *target_args)
+        finally:
+            conn.close()
+
+    if len(targets) <= 1:
+        return [run(target, a) for target, a in zip(targets, args)]
+    metrics.inc("shard_queries_total", len(targets))
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(targets))) as pool:
+        return list(pool.map(run, targets, args))
+
+def _create_shard(conn, period):
+    """Creates a shard file with the full schema and the main database's body settings."""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    path = shard_path(period)
+    init_db(path)
+
+    shard = connect(path)
+    for key in _BODY_SETTINGS:
+        set_setting(shard, key, get_setting(conn, key))
+    dict_id = get_setting(conn, 'body_dict_id')
+    if dict_id:
+        row = conn.execute("SELECT id, data, created_at FROM body_dicts WHERE id = ?", (int(dict_id),)).fetchone()
+        if row:
+            shard.execute("INSERT OR REPLACE INTO body_dicts (id, data, created_at) VALUES (?, ?, ?)", tuple(row))
+    shard.commit()
+    shard.close()
+
+    start_date, end_date = period_bounds(period)
+    conn.execute("INSERT INTO shards (period, path, start_date, end_date, read_only) VALUES (?, ?, ?, ?, 0)",
+                 (period, path, start_date, end_date))
+    conn.commit()
+    return path
+
+def shard_for_period(conn, period):
+    """Path of the writable shard for `period`, creating it if needed."""
+    row = conn.execute("SELECT path, read_only FROM shards WHERE period = ?", (period,)).fetchone()
+    if row is None:
+        return _create_shard(conn, period)
+    if row['read_only']:
+        raise RuntimeError(f"Shard {period} is read-only (run `main.py shard --thaw {period}` to write to it).")
+    return row['path']
+
+class Router:
+    """
+    Routes email writes to the database for their date: the connection's
+    own database when unsharded, otherwise the shard for the date's period
+    (created on first use). Frozen shards raise RuntimeError, but can be
+    checked for mail they already hold. Shard connections stay open until
+    close().
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.layout = get_layout(conn)
+        self._cursor = conn.cursor()
+        self._shards = {}
+        self._frozen = {}
+
+    def cursor(self, iso_date):
+        if self.layout == "none":
+            return self._cursor
+        period = period_for(iso_date, self.layout)
+        shard = self._shards.get(period)
+        if shard is None:
+            shard = connect(shard_for_period(self.conn, period))
+            self._shards[period] = shard = (shard, shard.cursor())
+        return shard[1]
+
+    def in_frozen_shard(self, iso_date, email_id, content_hash):
+        """True if the date's shard is frozen and already holds the email (same id or body)."""
+        if self.layout == "none":
+            return False
+        period = period_for(iso_date, self.layout)
+        shard = self._frozen.get(period)
+        if shard is None:
+            row = self.conn.execute("SELECT path FROM shards WHERE period = ? AND read_only = 1", (period,)).fetchone()
+            if row is None:
+                return False
+            shard = self._frozen[period] = connect(row['path'], read_only=True)
+        return shard.execute("SELECT 1 FROM emails WHERE id = ? OR content_hash = ? LIMIT 1",
+                             (email_id, content_hash)).fetchone() is not None
+
+    def commit(self):
+        # shards first, so a checkpoint in the main database never runs ahead of the data
+        for shard, _ in self._shards.values():
+            shard.commit()
+        self.conn.commit()
+
+    def close(self):
+        for shard, _ in self._shards.values():
+            shard.close()
+        for shard in self._frozen.values():
+            shard.close()
+        self._shards.clear()
+        self._frozen.clear()
+
+# Tables moved between mailtx.db and the shards, with the column that points
+# at the email.
+_CHILD_TABLES = (("embeddings", "email_id"), ("tx", "email_id"), ("email_minhash", "email_id"),
+                 ("minhash_buckets", "email_id"))
+
+def _copy(conn, schema, to_shard, where, args):
+    """
+    Moves the matching emails and their embeddings, tx and near-duplicate
+    rows between main and the attached schema.
+
+    content_hash is only unique within one database, so the destination may
+    already hold an email with the same body (or the same id). Such an email
+    is merged into the existing one: its child rows are re-pointed to the
+    surviving id and kept unless the survivor already has the equivalent row
+    (its own embedding or signature, or a tx with the same amount).
+
+    Returns (moved, merged) email counts.
+    """
+    src, dst = ("main", schema) if to_shard else (schema, "main")
+    conn.execute(f'''
+        CREATE TEMP TABLE move_ids AS
+        SELECT e.id AS id, COALESCE(
+            (SELECT d.id FROM {dst}.emails d WHERE d.id = e.id),
+            (SELECT d.id FROM {dst}.emails d WHERE d.content_hash = e.content_hash),
+            e.id) AS target_id
+        FROM {src}.emails e
+        WHERE {where}
+    ''', args)
+    # compressed bodies need their dictionary on the other side
+    conn.execute(f"INSERT OR IGNORE INTO {dst}.body_dicts SELECT * FROM {src}.body_dicts")
+
+    columns = ", ".join(row['name'] for row in conn.execute(f"PRAGMA {src}.table_info(emails)"))
+    moved = conn.execute(f"INSERT INTO {dst}.emails ({columns}) SELECT {columns} FROM {src}.emails "
+                         f"WHERE id IN (SELECT id FROM move_ids WHERE id = target_id)").rowcount
+    merged = conn.execute("SELECT COUNT(*) FROM move_ids WHERE id != target_id").fetchone()[0]
+
+    for table, key in _CHILD_TABLES:
+        names = [row['name'] for row in conn.execute(f"PRAGMA {src}.table_info({table})")]
+        values = ", ".join("m.target_id" if name == key else f"t.{name}" for name in names)
+        conn.execute(f"INSERT OR IGNORE INTO {dst}.{table} ({', '.join(names)}) "
+                     f"SELECT {values} FROM {src}.{table} t JOIN move_ids m ON m.id = t.{key}")
+
+    # every moved id is now either in the destination or merged into an email there
+    for table, key in _CHILD_TABLES:
+        conn.execute(f"DELETE FROM {src}.{table} WHERE {key} IN (SELECT id FROM move_ids)")
+    conn.execute(f"DELETE FROM {src}.emails WHERE id IN (SELECT id FROM move_ids)")
+    conn.execute("DROP TABLE move_ids")
+    return moved, merged
+
+def _merge_note(merged):
+    return f" ({merged} more merged into identical emails already there)" if merged else ""
+
+def _attach(conn, path):
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+
+def _merge_back(conn):
+    """Moves every shard's rows back into mailtx.db and deletes the shard files."""
+    for row in conn.execute("SELECT period, path FROM shards ORDER BY period").fetchall():
+        if os.path.exists(row['path']):
+            os.chmod(row['path'], stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+            _attach(conn, row['path'])
+            moved, merged = _copy(conn, "shard", False, "1=1", ())
+            conn.commit()
+            conn.execute("DETACH DATABASE shard")
+            os.remove(row['path'])
+            print(f"Merged {moved} emails from shard {row['period']}{_merge_note(merged)}.")
+        conn.execute("DELETE FROM shards WHERE period = ?", (row['period'],))
+    conn.commit()
+
+def _split(conn, layout):
+    """Moves mailtx.db's rows into per-period shards."""
+    conn.create_function("mailtx_period", 1, lambda date: period_for(date, layout), deterministic=True)
+    periods = [row[0] for row in conn.execute("SELECT DISTINCT mailtx_period(date) FROM emails ORDER BY 1")]
+    for period in periods:
+        path = shard_for_period(conn, period)
+        _attach(conn, path)
+        moved, merged = _copy(conn, "shard", True, "mailtx_period(date) = ?", (period,))
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+        print(f"Moved {moved} emails to shard {period} ({path}){_merge_note(merged)}.")
+    refresh_tx_dates(conn)
+
+@metrics.stage("shard")
+def set_layout(layout, vacuum=True):
+    """
+    Switches the database layout, moving existing emails, embeddings, tx
+    and near-duplicate rows. Re-sharding (e.g. year -> quarter) merges the
+    shards back into mailtx.db first.
+    """
+    conn = get_db_connection()
+    current = get_layout(conn)
+    if current == layout:
+        print(f"Layout is already '{layout}'.")
+        conn.close()
+        return
+
+    if current != "none":
+        conn.execute("UPDATE shards SET read_only = 0")
+        _merge_back(conn)
+    set_setting(conn, 'shard_layout', layout)
+    conn.commit()
+    if layout != "none":
+        _split(conn, layout)
+
+    if vacuum:
+        print("Vacuuming...")
+        conn.execute("VACUUM")
+    conn.close()
+    print(f"Layout is now '{layout}'.")
+
+def set_frozen(period, frozen=True):
+    """
+    Marks a shard read-only (or writable again). Freezing vacuums and
+    optimizes the shard once, then drops write permission on the file; it is
+    opened with immutable=1 from then on, so reads skip SQLite's locking.
+    """
+    conn = get_db_connection()
+    row = conn.execute("SELECT path FROM shards WHERE period = ?", (period,)).fetchone()
+    if row is None:
+        conn.close()
+        raise ValueError(f"No shard for period {period}")
+
+    path = row['path']
+    if frozen:
+        refresh_tx_dates(conn)
+        shard = connect(path)
+        shard.execute("VACUUM")
+        shard.execute("PRAGMA optimize")
+        shard.close()
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    else:
+        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    conn.execute("UPDATE shards SET read_only = ? WHERE period = ?", (int(frozen), period))
+    conn.commit()
+    conn.close()
+    print(f"Shard {period} is now {'read-only' if frozen else 'writable'}.")
+
+def list_shards():
+    conn = get_db_connection()
+    try:
+        layout = get_layout(conn)
+        rows = conn.execute("SELECT period, path, read_only FROM shards ORDER BY period").fetchall()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return
+    finally:
+        conn.close()
+
+    print(f"Layout: {layout}")
+    for row in rows:
+        shard = connect(row['path'], read_only=bool(row['read_only']))
+        emails = shard.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+        tx = shard.execute("SELECT COUNT(*) FROM tx").fetchone()[0]
+        shard.close()
+        size = os.path.getsize(row['path']) / 1e6
+        state = "read-only" if row['read_only'] else "writable"
+        print(f"  {row['period']:>8}: {emails:>8} emails {tx:>7} tx {size:9.2f} MB  {state}")
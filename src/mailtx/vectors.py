@@ -0,0 +1,132 @@
+import json
+import struct
+import numpy as np
+
+# Storage precisions for embedding vectors. float32 is the reference;
+# float16 halves it, int8 (per-vector scale) quarters it.
+PRECISIONS = ("float32", "float16", "int8")
+
+# Binary blob layout: MAGIC, one precision code byte, [float32 scale for int8],
+# then the little-endian values. Blobs without MAGIC are legacy JSON lists.
+MAGIC = b"MTV1"
+_CODES = {"float32": b"f", "float16": b"e", "int8": b"b"}
+_PRECISION_BY_CODE = {v: k for k, v in _CODES.items()}
+_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2"), "int8": np.dtype("i1")}
+_SCALE = struct.Struct("<f")
+_HEADER = len(MAGIC) + 1
+
+# Rows converted to float32 at a time while scoring a quantized matrix.
+SCORE_CHUNK = 65536
+
+def quantize(vector, precision):
+    """
+    Converts a float vector to `precision`. Returns (values, scale); scale is
+    only meaningful for int8, where vector ~= values * scale.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if precision == "int8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127.0 if peak else 1.0
+        return np.clip(np.round(vector / scale), -127, 127).astype(np.int8), scale
+    return vector.astype(_DTYPES[precision]), 1.0
+
+def encode_vector(vector, precision="float32"):
+    """Serializes a vector for the embeddings table."""
+    values, scale = quantize(vector, precision)
+    header = MAGIC + _CODES[precision]
+    if precision == "int8":
+        header += _SCALE.pack(scale)
+    return header + values.tobytes()
+
+def blob_precision(vector_blob):
+    """Precision of a stored blob, or 'json' for the legacy format."""
+    if vector_blob[:len(MAGIC)] == MAGIC:
+        return _PRECISION_BY_CODE[vector_blob[len(MAGIC):_HEADER]]
+    return "json"
+
+def raw_values(vector_blob):
+    """
+    Returns (precision, values, scale) without dequantizing. `values` is a
+    read-only view over the blob for binary formats.
+    """
+    precision = blob_precision(vector_blob)
+    if precision == "json":
+        return "float32", np.array(json.loads(vector_blob.decode('utf-8')), dtype=np.float32), 1.0
+    offset = _HEADER
+    scale = 1.0
+    if precision == "int8":
+        scale = _SCALE.unpack_from(vector_blob, offset)[0]
+        offset += _SCALE.size
+    return precision, np.frombuffer(vector_blob, dtype=_DTYPES[precision], offset=offset), scale
+
+def decode_vector(vector_blob):
+    """Deserializes a stored vector (any precision) to float32."""
+    precision, values, scale = raw_values(vector_blob)
+    return values.astype(np.float32) * np.float32(scale)
+
+def build_index(rows, precision=None):
+    """
+    Packs (email_id, vector_blob) rows into one matrix for vectorized scoring.
+
+    The matrix keeps the stored precision (taken from the first row unless
+    given), so an int8 archive occupies a quarter of float32's memory. int8
+    scales are dropped: a per-vector scale cancels out of cosine similarity.
+    Rows stored at another precision are re-quantized on load.
+
+    Returns a dict with ids, matrix, norms and precision.
+    """
+    rows = list(rows)
+    if precision is None:
+        precision = raw_values(rows[0][1])[0] if rows else "float32"
+
+    ids = []
+    matrix = None
+    filled = 0
+    for email_id, vector_blob in rows:
+        try:
+            stored, values, scale = raw_values(vector_blob)
+            if stored != precision:
+                values, _ = quantize(values.astype(np.float32) * np.float32(scale), precision)
+            if matrix is None:
+                matrix = np.empty((len(rows), values.shape[0]), dtype=_DTYPES[precision])
+            matrix[filled] = values
+        except Exception as e:
+            print(f"Error processing vector for {email_id}: {e}")
+            continue
+        ids.append(email_id)
+        filled += 1
+
+    if matrix is None:
+        matrix = np.empty((0, 0), dtype=_DTYPES[precision])
+    matrix = matrix[:filled]
+
+    norms = np.empty(filled, dtype=np.float32)
+    for start in range(0, filled, SCORE_CHUNK):
+        block = matrix[start:start + SCORE_CHUNK].astype(np.float32)
+        norms[start:start + SCORE_CHUNK] = np.linalg.norm(block, axis=1)
+
+    return {'ids': ids, 'matrix': matrix, 'norms': norms, 'precision': precision}
+
+def index_nbytes(index):
+    return index['matrix'].nbytes + index['norms'].nbytes
+
+def score_index(index, query_vector):
+    """Cosine similarity of `query_vector` against every row of the index."""
+    matrix = index['matrix']
+    query = np.asarray(query_vector, dtype=np.float32)
+    dots = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], SCORE_CHUNK):
+        block = matrix[start:start + SCORE_CHUNK]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        dots[start:start + SCORE_CHUNK] = block @ query
+    norms = index['norms'] * np.float32(np.linalg.norm(query))
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms != 0)
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
@@ -0,0 +1,10 @@
+from mailtx import compression
+
+def test_short_body_stays_plain_text():
+    assert compression.compress_body("Thanks!", "zlib") == "Thanks!"
+
+def test_compressible_body_round_trips():
+    text = "Your order has shipped. " * 50
+    blob = compression.compress_body(text, "zlib")
+    assert compression.is_compressed(blob) and len(blob) < len(text)
+    assert compression.decompress_body(blob) == text
@@ -0,0 +1,15 @@
+from mailtx import extractor
+
+TEMPLATE = {'merchant': 'Shop', 'currency': 'USD', 'category': 'Shopping'}
+
+def test_recheck_reads_total_not_subtotal():
+    tx = extractor.recheck_tx_data(TEMPLATE, "Subtotal: $40.00\nTax: $3.20\nTotal: $43.20")
+    assert tx['amount_cents'] == 4320
+
+def test_recheck_prefers_grand_total():
+    text = "Items total: $40.00\nShipping: $5.00\nGrand total: $45.00"
+    assert extractor.recheck_tx_data(TEMPLATE, text)['amount_cents'] == 4500
+
+def test_recheck_gives_up_on_conflicting_totals():
+    text = "Total: $40.00\nAmount paid: $25.00"
+    assert extractor.recheck_tx_data(TEMPLATE, text) is None
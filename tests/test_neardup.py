@@ -0,0 +1,44 @@
+from mailtx import neardup
+from mailtx.db import get_db_connection, init_db
+
+SENDER = "Uber <receipts@uber.com>"
+
+def _receipt(name, order_no, amount, currency="USD", merchant="Uber"):
+    subject = f"Your {merchant} receipt for order {order_no}"
+    body = "\n".join([
+        f"Hi {name},",
+        f"Thanks for your purchase from {merchant}.",
+        f"Order number: {order_no}",
+        "Category: Transport",
+        f"Total: {amount} {currency}",
+        "This payment has been charged to your card ending in 4242.",
+    ])
+    return subject, body
+
+def _cursor(tmp_path):
+    path = str(tmp_path / "mailtx.db")
+    init_db(path)
+    return get_db_connection(path).cursor()
+
+def test_receipts_differing_in_name_and_order_number_share_a_cluster(tmp_path):
+    c = _cursor(tmp_path)
+    receipts = [
+        _receipt("Alex", "112-3456789", "12.40"),
+        _receipt("Sam", "731-9876543", "8.15"),
+        _receipt("Priya", "450-1029384", "230.00", currency="EUR"),
+        _receipt("Jordan", "902-5647382", "41.99"),
+    ]
+    clusters = {neardup.index_email(c, f"e{i}", SENDER, subject, body)
+                for i, (subject, body) in enumerate(receipts)}
+    assert clusters == {"e0"}
+
+def test_other_senders_and_unrelated_mail_start_new_clusters(tmp_path):
+    c = _cursor(tmp_path)
+    subject, body = _receipt("Alex", "112-3456789", "12.40")
+    assert neardup.index_email(c, "e0", SENDER, subject, body) == "e0"
+
+    subject, body = _receipt("Sam", "731-9876543", "8.15", merchant="Lyft")
+    assert neardup.index_email(c, "e1", "Lyft <receipts@lyft.com>", subject, body) == "e1"
+
+    body = "Welcome to issue 12 of Dev Weekly. Release notes, community events and a code review guide."
+    assert neardup.index_email(c, "e2", SENDER, "Dev Weekly #12", body) == "e2"
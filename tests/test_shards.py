@@ -0,0 +1,20 @@
+from mailtx import db, parser, query_engine, shards
+
+def test_tx_dated_outside_its_emails_shard_is_found(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.init_db()
+    conn = db.get_db_connection()
+    c = conn.cursor()
+    parser.insert_email(c, "e1", "2024-02-10", "Shop <a@shop.com>", "Your receipt",
+                        "Total: $10.00, thanks for shopping with us.", "raw/e1.json")
+    c.execute('''
+        INSERT INTO tx (id, email_id, merchant, amount_cents, currency, tx_date, category, confidence)
+        VALUES ('tx_e1', 'e1', 'Shop', 1000, 'USD', '2023-11-15', 'Shopping', 1.0)
+    ''')
+    conn.commit()
+    conn.close()
+
+    shards.set_layout("year", vacuum=False)
+    params = {'metric': 'sum', 'start_date': '2023-11-01', 'end_date': '2023-11-30'}
+    assert [dict(row) for row in query_engine.execute_query(params)] == [{'total': 1000, 'currency': 'USD'}]
+    assert shards.databases('2022-01-01', '2022-12-31', for_tx=True) == []